@@ -1,5 +1,13 @@
+import os
+from metrics import metrics # Imported first so startup time includes every import
 import gradio as gr
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from services.face_service import FaceService
+from services.face_tracker import FaceTracker
+from services.adaptive_detector import AdaptiveDetector
+from services.stream_worker import StreamWorker
 from config import Config
 
 # State Initialization
@@ -14,27 +22,81 @@ def init_state():
     
     state = {
         'face_service': service, # Store the single instance of FaceService
+        'face_tracker': FaceTracker(), # Deep-copied, so each session tracks its own stream
+        'face_detector': AdaptiveDetector(), # Per-session detection schedule
+        'stream_worker': None, # Created lazily, one per session
+        'register_frame': None, # Unannotated camera frame behind the registration preview
         'last_reg_status': '',
         'last_reg_success': False,
         'last_manage_status': '',
         'last_manage_success': False,
     }
     print(f'Loaded {service.get_registered_count()} embeddings.')
+    metrics.set_gauge('startup_seconds', metrics.uptime())
+    print(f'Ready to serve after {metrics.uptime():.2f}s.')
     return state
 
 # Gradio Specific Functions (minimal logic, delegates to service)
 
+def get_stream_worker(state):
+    """Returns the session's background prediction worker, starting it on first use."""
+    if state['stream_worker'] is None:
+        service, tracker, detector = state['face_service'], state['face_tracker'], state['face_detector']
+        # Inference runs on the worker thread and the repository lookup on the
+        # service's I/O pool, so a frame's search overlaps the next frame's inference
+        state['stream_worker'] = StreamWorker(
+            lambda frame: service.analyze_frame(frame, tracker, detector),
+            finish_fn=lambda analysis: service.finish_prediction(analysis, tracker, in_place=True),
+            executor=service.io_executor,
+            # The governor lowers the processed frame rate and counts frames
+            # dropped because processing fell behind
+            min_interval=service.governor.frame_interval if service.governor else None,
+            on_drop=service.governor.record_drop if service.governor else None
+        )
+    return state['stream_worker']
+
+def close_state(state):
+    """Stops the session's background worker when the session ends."""
+    if state.get('stream_worker') is not None:
+        worker = state['stream_worker']
+        worker.stop()
+        print(f'Stream worker stopped: {worker.stats()}')
+
 def process_frame_predict_gradio(state, frame):
     """Processes frame for prediction mode using the stored FaceService instance."""
-    return state['face_service'].process_frame_for_prediction(frame)
+    if not Config.STREAM_BACKGROUND_WORKER:
+        return state['face_service'].process_frame_for_prediction(
+            frame, state['face_tracker'], state['face_detector'], in_place=True
+        )
+    # Returns immediately with the latest annotated frame, dropping stale frames
+    return get_stream_worker(state).submit(frame)
 
 def process_frame_register_gradio(state, frame):
     """Processes frame for registration preview using the stored FaceService instance."""
+    # The raw frame is kept for registration, so the preview is drawn on a copy
+    if frame is not None:
+        state['register_frame'] = frame
     return state['face_service'].process_frame_for_registration_preview(frame)
 
+def registration_snapshot(state, preview):
+    """Returns the raw camera frame behind the preview, falling back to the preview itself."""
+    # The preview's boxes would skew the quality checks and the embedding
+    return state['register_frame'] if state.get('register_frame') is not None else preview
+
 def register_face_gradio(state, name, frame_snapshot):
     """Attempts to register a face using the stored FaceService instance."""
-    status_message, success = state['face_service'].register_new_face(name, frame_snapshot)
+    status_message, success = state['face_service'].register_new_face(
+        name, registration_snapshot(state, frame_snapshot)
+    )
+    state['last_reg_status'] = status_message
+    state['last_reg_success'] = success
+    return state
+
+def add_face_sample_gradio(state, name, frame_snapshot):
+    """Adds the snapshot as another sample of a registered face."""
+    status_message, success = state['face_service'].add_face_sample(
+        name, registration_snapshot(state, frame_snapshot)
+    )
     state['last_reg_status'] = status_message
     state['last_reg_success'] = success
     return state
@@ -86,12 +148,34 @@ def show_manage_feedback(state):
     else:
         return gr.Info(status)
 
+def render_stats_gradio(state):
+    """Renders the pipeline latency stats and this session's stream counters."""
+    stats = metrics.render_markdown()
+    worker = state.get('stream_worker')
+    if worker is not None:
+        counts = worker.stats()
+        stats += (
+            f"\n\nThis session: {counts['processed']} frames processed, "
+            f"{counts['dropped']} dropped, {counts['errors']} errors."
+        )
+    governor = state['face_service'].governor
+    if governor is not None:
+        level = governor.current
+        stats += (
+            f"\n\nLoad governor level {governor.level}: {level['model']}, "
+            f"detection at {level['detection_size'][0]}x{level['detection_size'][1]}, "
+            f"a frame every {level['stream_interval']}s"
+        )
+        if worker is not None:
+            stats += f" ({worker.stats()['throttled']} frames skipped this session)"
+    return stats
+
 
 # Build Gradio App
 
 with gr.Blocks(theme=gr.themes.Monochrome()) as demo:
     # Initialize state once when the app starts
-    app_state = gr.State(value=init_state())
+    app_state = gr.State(value=init_state(), delete_callback=close_state)
 
     gr.Markdown('# Face Recognition App')
     gr.Markdown('Use the tabs below to switch between modes.')
@@ -112,7 +196,16 @@ with gr.Blocks(theme=gr.themes.Monochrome()) as demo:
                 fn=process_frame_predict_gradio,
                 inputs=[app_state, predict_camera_input],
                 outputs=predict_processed_output,
-                stream_every=Config.STREAM_INTERVAL
+                stream_every=Config.STREAM_INTERVAL,
+                concurrency_limit=None # Bounded by the inference session pool instead
+            )
+
+            with gr.Accordion('Performance Stats', open=False):
+                stats_display = gr.Markdown(value='No frames processed yet.')
+            gr.Timer(Config.METRICS_REFRESH_INTERVAL).tick(
+                fn=render_stats_gradio,
+                inputs=app_state,
+                outputs=stats_display
             )
 
         # Registration Tab 
@@ -127,6 +220,7 @@ with gr.Blocks(theme=gr.themes.Monochrome()) as demo:
                         label='Name', placeholder='Enter name to register'
                     )
                     register_button = gr.Button('Register Face from Preview', variant='primary')
+                    add_sample_button = gr.Button('Add Preview as Sample of Existing Name')
                 with gr.Column():
                     register_processed_output = gr.Image(
                         label='Face Detection Preview', type='numpy', height=480, width=640, interactive=False
@@ -136,7 +230,8 @@ with gr.Blocks(theme=gr.themes.Monochrome()) as demo:
                 fn=process_frame_register_gradio,
                 inputs=[app_state, register_camera_input],
                 outputs=register_processed_output,
-                stream_every=Config.STREAM_INTERVAL
+                stream_every=Config.STREAM_INTERVAL,
+                concurrency_limit=None
             )
 
             register_button.click(
@@ -157,6 +252,21 @@ with gr.Blocks(theme=gr.themes.Monochrome()) as demo:
                 outputs=name_textbox
             )
 
+            # More samples of the same person (other light, pose) improve recognition
+            add_sample_button.click(
+                fn=add_face_sample_gradio,
+                inputs=[app_state, name_textbox, register_processed_output],
+                outputs=[app_state]
+            ).then(
+                fn=show_register_feedback,
+                inputs=app_state,
+                outputs=None
+            ).then(
+                fn=lambda state: gr.update(value=f"**Status:** {state['last_reg_status']}"),
+                inputs=app_state,
+                outputs=register_status_display
+            )
+
         # Manage Faces Tab 
         with gr.TabItem('Manage Faces') as manage_tab:
             with gr.Row():
@@ -225,7 +335,20 @@ with gr.Blocks(theme=gr.themes.Monochrome()) as demo:
                  outputs=manage_face_selector
             )
 
+# Serve the Gradio app alongside a Prometheus metrics endpoint
+server = FastAPI()
+
+@server.get(Config.METRICS_PATH, response_class=PlainTextResponse)
+def metrics_endpoint():
+    return metrics.render_prometheus()
+
+server = gr.mount_gradio_app(server, demo, path='/')
+
 # Launch the app
 if __name__ == '__main__':
     print('Launching Gradio app...')
-    demo.launch()
\ No newline at end of file
+    uvicorn.run(
+        server,
+        host=os.getenv('GRADIO_SERVER_NAME', '127.0.0.1'),
+        port=int(os.getenv('GRADIO_SERVER_PORT', 7860))
+    )
\ No newline at end of file
@@ -0,0 +1,285 @@
+'''
+Offline benchmark for the recognition pipeline.
+
+Drives FaceService.process_frame_for_prediction and register_new_face with
+recorded or synthetic frames against an in-process repository stand-in, so
+no webcam or MongoDB cluster is needed. Results are printed and written as
+JSON for comparison between releases.
+
+Usage:
+    python -m benchmarks.pipeline_benchmark --output bench_results.json
+    python -m benchmarks.pipeline_benchmark --frames-dir recordings/ --galleries 1000 10000
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+# The benchmark never talks to MongoDB
+os.environ.setdefault('FACE_REPOSITORY_BACKEND', 'local')
+os.environ.setdefault('ADMIN_PASSWORD', 'benchmark')
+
+import cv2
+import numpy as np
+from config import Config
+from db import identity_templates
+from db.base_repository import BaseFaceRepository
+from db.embedding_index import EmbeddingIndex
+from db.local_store import LocalFaceRepository
+from metrics import metrics
+from services.face_analyzer import FaceAnalyzer
+from services.face_service import FaceService
+from services.face_tracker import FaceTracker
+
+class InMemoryFaceRepository(BaseFaceRepository):
+    '''In-process stand-in for FaceRepository backed by an EmbeddingIndex.'''
+
+    def __init__(self, dim: int = 512):
+        self.index = EmbeddingIndex(dim)
+        self.names: set[str] = set()
+        self.members: dict[str, list[np.ndarray]] = {}
+
+    @metrics.timed('repository.insert_embedding')
+    def insert_embedding(self, name: str, emb: np.ndarray) -> None:
+        self.index.add(name, emb)
+        self.names.add(name)
+
+    @metrics.timed('repository.add_member')
+    def add_member(self, name: str, emb: np.ndarray) -> bool:
+        if name not in self.names:
+            return False
+        updated = identity_templates.add_member(self.members.get(name) or [self.index.get(name)], emb)
+        if updated is None:
+            return False
+        self.members[name] = updated
+        self.index.remove(name)
+        self.index.add(name, identity_templates.centroid(updated))
+        return True
+
+    @metrics.timed('repository.is_name_taken')
+    def is_name_taken(self, name: str) -> bool:
+        return name in self.names
+
+    def insert_embeddings(self, items: list[tuple[str, np.ndarray]]) -> int:
+        for name, emb in items:
+            self.insert_embedding(name, emb)
+        return len(items)
+
+    def update_name(self, old_name: str, new_name: str) -> bool:
+        if old_name not in self.names:
+            return False
+        self.index.rename(old_name, new_name)
+        self.names.discard(old_name)
+        self.names.add(new_name)
+        if old_name in self.members:
+            self.members[new_name] = self.members.pop(old_name)
+        return True
+
+    def delete_name(self, name: str) -> bool:
+        if name not in self.names:
+            return False
+        self.index.remove(name)
+        self.names.discard(name)
+        self.members.pop(name, None)
+        return True
+
+    def get_all_names(self) -> list[str]:
+        return sorted(self.names)
+
+    def get_count(self) -> int:
+        return len(self.index)
+
+    @metrics.timed('repository.search_faces')
+    def search_faces(self, embeddings: list[np.ndarray]) -> list[tuple[str, float, bool]]:
+        if not embeddings:
+            return []
+        candidates = self.index.top_k(np.stack([emb.flatten() for emb in embeddings]), Config.VECTOR_SEARCH_LIMIT)
+        return [
+            identity_templates.rerank(emb, [(name, score, self.members.get(name)) for name, score in matches])
+            for emb, matches in zip(embeddings, candidates)
+        ]
+
+def populate_gallery(repository: BaseFaceRepository, size: int, seed: int = 0) -> None:
+    # Random unit vectors are near-orthogonal in 512-d, like unrelated identities
+    rng = np.random.default_rng(seed)
+    for start in range(0, size, 10_000):
+        batch = rng.standard_normal((min(10_000, size - start), 512)).astype(np.float32)
+        repository.insert_embeddings([(f'person_{start + i}', emb) for i, emb in enumerate(batch)])
+
+def create_repository(kind: str, gallery_size: int, store_dir: str) -> BaseFaceRepository:
+    # `store_dir` holds the local store and is removed by the caller
+    if kind == 'memory':
+        repository = InMemoryFaceRepository()
+        populate_gallery(repository, gallery_size)
+        return repository
+
+    repository = LocalFaceRepository(store_dir)
+    populate_gallery(repository, gallery_size)
+    repository.build_index()
+    return repository
+
+def load_frames(frames_dir: str | None) -> list[np.ndarray]:
+    # Frames are converted to RGB, matching what the Gradio camera delivers
+    if frames_dir:
+        paths = sorted(
+            p for p in Path(frames_dir).iterdir()
+            if p.suffix.lower() in ('.jpg', '.jpeg', '.png', '.bmp')
+        )
+        frames = [cv2.imread(str(p)) for p in paths]
+        return [cv2.cvtColor(f, cv2.COLOR_BGR2RGB) for f in frames if f is not None]
+
+    from insightface.data import get_image
+    return [cv2.cvtColor(get_image('t1'), cv2.COLOR_BGR2RGB)]
+
+def face_crops(analyzer: FaceAnalyzer, frames: list[np.ndarray]) -> list[np.ndarray]:
+    crops = []
+    for frame in frames:
+        for face in analyzer.detect_faces(frame):
+            x0, y0, x1, y1 = face.bbox.astype(int)
+            w, h = x1 - x0, y1 - y0
+            x0, y0 = max(0, x0 - w // 2), max(0, y0 - h // 2)
+            crops.append(frame[y0:y1 + h // 2, x0:x1 + w // 2].copy())
+    return crops
+
+def synthetic_frame(crops: list[np.ndarray], num_faces: int, size=(720, 1280)) -> np.ndarray:
+    '''Lays out `num_faces` face crops on a grid over a neutral background.'''
+    height, width = size
+    frame = np.full((height, width, 3), 127, dtype=np.uint8)
+    cols = int(np.ceil(np.sqrt(num_faces * width / height)))
+    rows = int(np.ceil(num_faces / cols))
+    cell_h, cell_w = height // rows, width // cols
+
+    for i in range(num_faces):
+        crop = crops[i % len(crops)]
+        scale = min(cell_h / crop.shape[0], cell_w / crop.shape[1]) * 0.9
+        crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))))
+        r, c = divmod(i, cols)
+        y, x = r * cell_h, c * cell_w
+        frame[y:y + crop.shape[0], x:x + crop.shape[1]] = crop
+    return frame
+
+def memory_usage_mb() -> dict:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KiB on Linux
+    current = peak
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        pass
+    return {'rss_mb': round(current, 1), 'peak_rss_mb': round(peak, 1)}
+
+def run_scenario(service: FaceService, frame: np.ndarray, iterations: int, warmup: int, track: bool) -> dict:
+    tracker = FaceTracker() if track else None
+    for _ in range(warmup):
+        service.process_frame_for_prediction(frame, tracker)
+
+    metrics.reset()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        service.process_frame_for_prediction(frame, tracker)
+    elapsed = time.perf_counter() - start
+
+    snapshot = metrics.snapshot()
+    return {
+        'fps': iterations / elapsed,
+        'faces_detected': snapshot['values'].get('faces_per_frame', {}).get(50, 0),
+        'stages_ms': {
+            stage: {q: round(stats[q] * 1000, 3) for q in (50, 95, 99)}
+            for stage, stats in snapshot['latencies'].items()
+        },
+        'errors': {label: value for (name, label), value in snapshot['counters'].items() if name == 'errors'},
+    }
+
+def run_registration(service: FaceService, frame: np.ndarray, iterations: int) -> dict:
+    # The same face is registered every iteration, so it is deleted again
+    # (outside the timing) to keep later registrations from being rejected
+    # as duplicates
+    metrics.reset()
+    elapsed = 0.0
+    for i in range(iterations):
+        name = f'benchmark_{time.time_ns()}_{i}'
+        start = time.perf_counter()
+        message, registered = service.register_new_face(name, frame)
+        elapsed += time.perf_counter() - start
+        if not registered:
+            raise SystemExit(f'Benchmark registration failed: {message}')
+        service.delete_existing_face(name, Config.ADMIN_PASSWORD)
+    stats = metrics.snapshot()['latencies']
+    return {
+        'registrations_per_sec': iterations / elapsed,
+        'stages_ms': {
+            stage: {q: round(s[q] * 1000, 3) for q in (50, 95, 99)}
+            for stage, s in stats.items()
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the face recognition pipeline offline.')
+    parser.add_argument('--frames-dir', help='Directory of recorded frames (defaults to the InsightFace sample image)')
+    parser.add_argument('--faces', type=int, nargs='+', default=[1, 4, 8], help='Faces per synthetic frame')
+    parser.add_argument('--galleries', type=int, nargs='+', default=[1_000, 10_000, 100_000], help='Registered identities')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--repository', choices=['memory', 'local'], default='memory',
+                        help='In-memory stand-in or the memory-mapped local store')
+    parser.add_argument('--track', action='store_true', help='Run prediction with a face tracker')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write JSON results')
+    args = parser.parse_args()
+
+    analyzer = FaceAnalyzer()
+    frames = load_frames(args.frames_dir)
+    crops = face_crops(analyzer, frames)
+    if not crops:
+        raise SystemExit('No faces found in the benchmark frames.')
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'model': Config.INSIGHTFACE_MODEL_NAME,
+            'providers': Config.INSIGHTFACE_PROVIDERS,
+            'detection_size': list(Config.DETECTION_SIZE),
+            'tracking': args.track,
+            'repository': args.repository,
+        },
+        'prediction': [],
+        'registration': [],
+    }
+
+    for gallery_size in args.galleries:
+        # The local store's files are deleted once the gallery size is done
+        with tempfile.TemporaryDirectory(prefix='face_store_bench_', ignore_cleanup_errors=True) as store_dir:
+            repository = create_repository(args.repository, gallery_size, store_dir)
+            service = FaceService(face_analyzer=analyzer, face_repository=repository)
+
+            # Recorded frames are replayed as-is; synthetic frames vary the face count
+            scenarios = (
+                [(f'recorded_{i}', frame) for i, frame in enumerate(frames)] if args.frames_dir
+                else [(f'{n}_faces', synthetic_frame(crops, n)) for n in args.faces]
+            )
+            for label, frame in scenarios:
+                result = run_scenario(service, frame, args.iterations, args.warmup, args.track)
+                result.update({'gallery_size': gallery_size, 'frame': label, **memory_usage_mb()})
+                results['prediction'].append(result)
+                print(
+                    f'[predict] gallery={gallery_size:>7} frame={label:<12} '
+                    f'{result["fps"]:7.2f} fps  faces={result["faces_detected"]:.0f}  '
+                    f'rss={result["rss_mb"]} MB'
+                )
+
+            result = run_registration(service, synthetic_frame(crops, 1), max(1, args.iterations // 5))
+            result.update({'gallery_size': gallery_size, **memory_usage_mb()})
+            results['registration'].append(result)
+            print(f'[register] gallery={gallery_size:>7} {result["registrations_per_sec"]:7.2f} registrations/s')
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+if __name__ == '__main__':
+    main()
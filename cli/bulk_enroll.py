@@ -0,0 +1,228 @@
+'''
+Headless bulk enrollment from image directories and video files.
+
+Every subdirectory of the input directory is one identity named after the
+directory, holding any number of images and videos of that person. Image or
+video files placed directly in the input directory are enrolled under their
+file name. The best face found across an identity's inputs is registered.
+
+Usage:
+    python -m cli.bulk_enroll /path/to/people --workers 4 --chunk-size 500
+
+Progress is appended to a state file, so an interrupted run can be resumed
+by running the same command again. With the load governor enabled, the
+galleries of its other models are filled by enrolling again with
+`--model buffalo_s` (and a separate `--state-file`).
+'''
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import cv2
+import numpy as np
+from cli.workers import init_worker, get_analyzer
+from db.embedding_index import EmbeddingIndex
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.webm'}
+FINAL_STATUSES = {'enrolled', 'duplicate', 'skipped'}
+
+def discover_identities(input_dir: Path) -> list[tuple[str, list[str]]]:
+    identities = []
+    for entry in sorted(input_dir.iterdir()):
+        if entry.is_dir():
+            files = sorted(
+                str(p) for p in entry.rglob('*')
+                if p.suffix.lower() in IMAGE_EXTENSIONS | VIDEO_EXTENSIONS
+            )
+            identities.append((entry.name, files))
+        elif entry.suffix.lower() in IMAGE_EXTENSIONS | VIDEO_EXTENSIONS:
+            identities.append((entry.stem, [str(entry)]))
+    return identities
+
+def iter_frames(path: str, video_stride: int, max_video_frames: int):
+    # Frames are converted to RGB, matching what the Gradio camera delivers,
+    # so bulk-enrolled embeddings are comparable with live predictions
+    if Path(path).suffix.lower() in IMAGE_EXTENSIONS:
+        image = cv2.imread(path)
+        if image is not None:
+            yield cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return
+
+    capture = cv2.VideoCapture(path)
+    index = sampled = 0
+    try:
+        while sampled < max_video_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if index % video_stride == 0:
+                sampled += 1
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            index += 1
+    finally:
+        capture.release()
+
+def embed_identity(args: tuple[str, list[str], int, int]) -> tuple[str, np.ndarray | None, str]:
+    '''
+    Returns (name, embedding, status). For every frame only the largest face
+    is considered; the one with the highest detector score is kept.
+    '''
+    name, files, video_stride, max_video_frames = args
+    if not files:
+        return name, None, 'skipped: no images or videos'
+
+    analyzer = get_analyzer()
+    try:
+        best_face, best_frame = None, None
+        for path in files:
+            for frame in iter_frames(path, video_stride, max_video_frames):
+                faces = analyzer.detect_faces(frame)
+                if not faces:
+                    continue
+                face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+                if best_face is None or face.det_score > best_face.det_score:
+                    best_face, best_frame = face, frame
+
+        if best_face is None:
+            return name, None, 'skipped: no face detected'
+
+        # Only the selected face goes through the recognition model
+        analyzer.embed_faces(best_frame, [best_face])
+        if best_face.embedding is None:
+            return name, None, 'failed: could not compute embedding'
+        return name, best_face.embedding, 'ok'
+    except Exception as e:
+        return name, None, f'failed: {e}'
+
+def load_state(state_file: Path) -> dict[str, str]:
+    if not state_file.exists():
+        return {}
+    state = {}
+    with open(state_file) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                state[entry['name']] = entry['status']
+    return state
+
+class Enroller:
+    '''Dedupes embedded identities and writes them in chunks with insert_many.'''
+
+    def __init__(self, repository, chunk_size: int, state_file: Path, dry_run: bool):
+        self.repository = repository
+        self.chunk_size = chunk_size
+        self.state_file = state_file
+        self.dry_run = dry_run
+        self.taken_names = set(repository.get_all_names())
+        # Identities enrolled by this run; Atlas indexes new documents
+        # asynchronously, so they are deduped against locally as well
+        self.enrolled = EmbeddingIndex()
+        self.pending: list[tuple[str, np.ndarray]] = []
+        self.summary = Counter()
+        self.messages: list[str] = []
+
+    def record(self, name: str, status: str, detail: str = '') -> None:
+        self.summary[status] += 1
+        if detail:
+            self.messages.append(f'{status:<9} {name}: {detail}')
+        if self.dry_run:
+            return
+        with open(self.state_file, 'a') as f:
+            f.write(json.dumps({'name': name, 'status': status, 'detail': detail}) + '\n')
+
+    def add(self, name: str, embedding: np.ndarray | None, status: str) -> None:
+        if embedding is None:
+            self.record(name, status.split(':')[0], status.split(':', 1)[-1].strip())
+            return
+        if name in self.taken_names:
+            self.record(name, 'skipped', 'name already registered')
+            return
+        self.taken_names.add(name)
+        self.pending.append((name, embedding))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        chunk, self.pending = self.pending, []
+
+        try:
+            results = self.repository.search_faces([emb for _, emb in chunk])
+        except Exception as e:
+            for name, _ in chunk:
+                self.taken_names.discard(name)
+                self.record(name, 'failed', f'search error: {e}')
+            return
+
+        to_insert = []
+        for (name, emb), (existing_name, similarity, match) in zip(chunk, results):
+            if not match:
+                local = self.enrolled.search(emb.reshape(1, -1))[0]
+                existing_name, similarity, match = local
+            if match:
+                self.taken_names.discard(name)
+                self.record(name, 'duplicate', f'matches "{existing_name}" ({similarity:.2f})')
+                continue
+            self.enrolled.add(name, emb)
+            to_insert.append((name, emb))
+
+        try:
+            if not self.dry_run:
+                self.repository.insert_embeddings(to_insert)
+        except Exception as e:
+            for name, _ in to_insert:
+                self.record(name, 'failed', f'insert error: {e}')
+            return
+
+        for name, _ in to_insert:
+            self.record(name, 'enrolled')
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-enroll faces from a directory of images and videos.')
+    parser.add_argument('input_dir', help='Directory with one subdirectory (or file) per identity')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--chunk-size', type=int, default=500, help='Identities per insert_many')
+    parser.add_argument('--video-stride', type=int, default=10, help='Sample every Nth video frame')
+    parser.add_argument('--max-video-frames', type=int, default=30, help='Max sampled frames per video')
+    parser.add_argument('--state-file', default='bulk_enroll_state.jsonl', help='Progress file used to resume')
+    parser.add_argument('--dry-run', action='store_true', help='Run everything except the database writes')
+    parser.add_argument('--model', help='Model (and gallery) to enroll with, defaults to INSIGHTFACE_MODEL_NAME')
+    args = parser.parse_args()
+
+    from db.repositories import create_face_repository
+
+    input_dir = Path(args.input_dir)
+    state_file = Path(args.state_file)
+    done = {name for name, status in load_state(state_file).items() if status in FINAL_STATUSES}
+    identities = [(name, files) for name, files in discover_identities(input_dir) if name not in done]
+    print(f'{len(identities)} identities to process ({len(done)} already done in a previous run).')
+
+    enroller = Enroller(create_face_repository(args.model), args.chunk_size, state_file, args.dry_run)
+    threads_per_worker = max(1, (os.cpu_count() or 1) // args.workers)
+    tasks = ((name, files, args.video_stride, args.max_video_frames) for name, files in identities)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=init_worker,
+        initargs=(threads_per_worker, args.model)
+    ) as executor:
+        for i, (name, embedding, status) in enumerate(executor.map(embed_identity, tasks, chunksize=4), 1):
+            enroller.add(name, embedding, status)
+            if i % 100 == 0:
+                print(f'Processed {i}/{len(identities)} identities ({time.perf_counter() - start:.0f}s)')
+    enroller.flush()
+
+    print(f'\nFinished in {time.perf_counter() - start:.1f}s')
+    for status in ('enrolled', 'duplicate', 'skipped', 'failed'):
+        print(f'  {status:<10} {enroller.summary[status]}')
+    for message in enroller.messages:
+        print(f'  {message}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+'''
+Converts stored embeddings to the configured vector storage format.
+
+Usage:
+    python -m cli.migrate_vectors                 # to Config.VECTOR_STORAGE_FORMAT
+    python -m cli.migrate_vectors --format int8 --batch-size 1000
+
+Documents already in the target format are left untouched, so the migration
+can be interrupted and rerun safely.
+'''
+import argparse
+import time
+from pymongo import UpdateOne
+from config import Config
+from db.database import MongoDB
+from db.repositories import MEMBERS_FIELD
+from db.vector_codec import decode_vector, encode_vector, storage_format_of
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert stored embeddings to another storage format.')
+    parser.add_argument('--format', default=Config.VECTOR_STORAGE_FORMAT, choices=['float32', 'int8', 'list'])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be converted')
+    args = parser.parse_args()
+
+    field = Config.VECTOR_SEARCH_FIELD_PATH
+    collection = MongoDB.get_embeddings_collection()
+    total = collection.count_documents({})
+    print(f'Converting {total} documents to "{args.format}"...')
+
+    start = time.perf_counter()
+    scanned = converted = 0
+    batch = []
+
+    def flush():
+        nonlocal converted
+        if batch and not args.dry_run:
+            converted += collection.bulk_write(batch, ordered=False).modified_count
+        elif batch:
+            converted += len(batch)
+        batch.clear()
+
+    for doc in collection.find({field: {'$exists': True}}, {field: 1, MEMBERS_FIELD: 1}):
+        scanned += 1
+        # Identity template members are converted along with the centroid
+        values = {field: doc[field]}
+        if MEMBERS_FIELD in doc:
+            values[MEMBERS_FIELD] = doc[MEMBERS_FIELD]
+        if all(
+            storage_format_of(v) == args.format
+            for v in [values[field], *values.get(MEMBERS_FIELD, [])]
+        ):
+            continue
+
+        update = {field: encode_vector(decode_vector(values[field]), args.format)}
+        if MEMBERS_FIELD in values:
+            update[MEMBERS_FIELD] = [encode_vector(decode_vector(v), args.format) for v in values[MEMBERS_FIELD]]
+        batch.append(UpdateOne({'_id': doc['_id']}, {'$set': update}))
+        if len(batch) >= args.batch_size:
+            flush()
+            print(f'  {scanned}/{total} scanned, {converted} converted')
+    flush()
+
+    print(
+        f'Done in {time.perf_counter() - start:.1f}s: {scanned} scanned, '
+        f'{converted} {"to convert" if args.dry_run else "converted"}.'
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+'''
+Headless recognition over recorded footage, camera dumps or RTSP streams.
+
+Frames flow through a generator pipeline whose stages overlap: a decoder
+thread reads frames into a bounded queue, a process pool detects and embeds
+faces, and the main process resolves identities and writes one JSONL event
+per frame. Memory stays bounded by the queue size and the number of frames
+in flight.
+
+Usage:
+    python -m cli.process_video footage.mp4 --output events.jsonl
+    python -m cli.process_video rtsp://camera/stream --stride 5 --annotated-video out.mp4
+'''
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from insightface.app.common import Face
+from cli.workers import init_worker, get_analyzer
+
+_END = object()
+
+def decode_frames(capture: cv2.VideoCapture, stride: int, queue_size: int):
+    '''Yields (index, timestamp_seconds, rgb_frame), decoding on a separate thread.'''
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Gives up once the consumer stopped, instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        index = 0
+        try:
+            while not stop.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                if index % stride == 0:
+                    timestamp = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                    # Converted to RGB to match the frames embeddings were registered from
+                    if not put((index, timestamp, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))):
+                        break
+                index += 1
+        finally:
+            capture.release()
+            put(_END)
+
+    thread = threading.Thread(target=reader, name='video-decoder', daemon=True)
+    thread.start()
+    try:
+        while (item := frames.get()) is not _END:
+            yield item
+    finally:
+        stop.set()
+
+def analyze_frame(frame: np.ndarray) -> list[dict]:
+    analyzer = get_analyzer()
+    faces = analyzer.compute_embeddings(frame)
+    # Plain dicts travel between processes more reliably than Face objects
+    return [
+        {'bbox': f.bbox, 'kps': f.kps, 'det_score': f.det_score, 'embedding': f.embedding}
+        for f in faces if f.embedding is not None
+    ]
+
+def detect_and_embed(frames, executor: ProcessPoolExecutor | None, analyzer, max_in_flight: int):
+    '''Yields (index, timestamp, frame, faces) in input order.'''
+    if executor is None:
+        for index, timestamp, frame in frames:
+            yield index, timestamp, frame, analyzer.compute_embeddings(frame)
+        return
+
+    in_flight = deque()
+    for index, timestamp, frame in frames:
+        in_flight.append((index, timestamp, frame, executor.submit(analyze_frame, frame)))
+        if len(in_flight) >= max_in_flight:
+            index, timestamp, frame, future = in_flight.popleft()
+            yield index, timestamp, frame, [Face(d) for d in future.result()]
+
+    while in_flight:
+        index, timestamp, frame, future = in_flight.popleft()
+        yield index, timestamp, frame, [Face(d) for d in future.result()]
+
+def resolve_identities(stream, repository):
+    '''Yields (index, timestamp, frame, identified) with one batched search per frame.'''
+    for index, timestamp, frame, faces in stream:
+        results = repository.search_faces([face.embedding for face in faces])
+        yield index, timestamp, frame, list(zip(faces, results))
+
+def to_event(index: int, timestamp: float, identified) -> dict:
+    return {
+        'frame': index,
+        'timestamp': round(timestamp, 3),
+        'faces': [
+            {
+                'bbox': [round(float(v), 1) for v in face.bbox],
+                'det_score': round(float(face.det_score), 4),
+                'name': name if match else None,
+                'candidate': name or None,
+                'score': round(float(score), 4),
+                'match': bool(match),
+            }
+            for face, (name, score, match) in identified
+        ],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Run face recognition over a video file or stream.')
+    parser.add_argument('source', help='Video file path or stream URL (e.g. rtsp://...)')
+    parser.add_argument('--output', default='-', help='JSONL events file, "-" for stdout')
+    parser.add_argument('--annotated-video', help='Optional path for an annotated output video')
+    parser.add_argument('--stride', type=int, default=1, help='Process every Nth frame')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='Inference processes, 0 to run in-process')
+    parser.add_argument('--queue-size', type=int, default=32, help='Decoded frames buffered ahead of inference')
+    parser.add_argument('--skip-empty', action='store_true', help='Do not emit events for frames without faces')
+    args = parser.parse_args()
+
+    from db.repositories import create_face_repository
+    from services.face_service import FaceService
+    from services.renderer import renderer
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    # Keep stdout for events only; model and progress logs go to stderr
+    sys.stdout = sys.stderr
+
+    repository = create_face_repository()
+    writer = None
+    executor = None
+    analyzer = None
+    if args.workers > 0:
+        executor = ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=init_worker,
+            initargs=(max(1, (os.cpu_count() or 1) // args.workers),)
+        )
+    else:
+        # The models are only loaded here when inference runs in-process
+        from services.face_analyzer import FaceAnalyzer
+        analyzer = FaceAnalyzer()
+
+    capture = cv2.VideoCapture(args.source)
+    if not capture.isOpened():
+        raise SystemExit(f'Could not open video source: {args.source}')
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25
+
+    frames = decode_frames(capture, args.stride, args.queue_size)
+    stream = detect_and_embed(frames, executor, analyzer, max_in_flight=max(2, args.workers * 2))
+    stream = resolve_identities(stream, repository)
+
+    start = time.perf_counter()
+    processed = 0
+    try:
+        for index, timestamp, frame, identified in stream:
+            processed += 1
+            if identified or not args.skip_empty:
+                out.write(json.dumps(to_event(index, timestamp, identified)) + '\n')
+
+            if args.annotated_video:
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(
+                        args.annotated_video, cv2.VideoWriter_fourcc(*'mp4v'),
+                        fps / args.stride, (width, height)
+                    )
+                annotated = renderer.draw(frame, FaceService.prediction_annotations(identified), in_place=True)
+                writer.write(cv2.cvtColor(annotated, cv2.COLOR_RGB2BGR))
+    finally:
+        # Stops the decoder thread, also when the loop ended early
+        frames.close()
+        if writer is not None:
+            writer.release()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if out is not sys.__stdout__:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f'Processed {processed} frames in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.2f} fps).')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+from config import Config
+
+# Per-process FaceAnalyzer for process pool workers
+_analyzer = None
+
+def init_worker(threads_per_worker: int, model_name: str | None = None) -> None:
+    global _analyzer
+    from services.face_analyzer import FaceAnalyzer
+
+    # Bound ONNX Runtime threads so workers do not oversubscribe the cores
+    Config.ONNX_INTRA_OP_THREADS = threads_per_worker
+    Config.ONNX_INTER_OP_THREADS = 1
+    Config.INFERENCE_SESSION_POOL_SIZE = 1 # Parallelism comes from the process pool
+    # Each worker serves a single caller, so there is nothing to batch across
+    Config.INFERENCE_BATCHING = False
+    _analyzer = FaceAnalyzer(model_name)
+
+def get_analyzer():
+    return _analyzer
@@ -4,6 +4,14 @@ from dotenv import load_dotenv
 load_dotenv()
 
 class Config:
+    # Storage backend: 'mongo' (MongoDB Atlas vector search) or 'local'
+    # (memory-mapped embedding file, for offline/edge deployments)
+    FACE_REPOSITORY_BACKEND = os.getenv('FACE_REPOSITORY_BACKEND', 'mongo')
+    LOCAL_STORE_PATH = os.getenv('LOCAL_STORE_PATH', 'data/face_store')
+    LOCAL_STORE_IVF_MIN_SIZE = 20_000 # Gallery size from which an approximate IVF index is used
+    LOCAL_STORE_IVF_LISTS = None # IVF buckets, None for 4 * sqrt(gallery size)
+    LOCAL_STORE_IVF_NPROBE = 8 # Buckets scored per query
+
     # MongoDB configuration
     MONGO_URI = os.getenv('MONGO_URI')
     DATABASE_NAME = os.getenv('DATABASE_NAME')
@@ -14,23 +22,149 @@ class Config:
 
     # InsightFace configuration
     INSIGHTFACE_MODEL_NAME = 'buffalo_l' # Or 'buffalo_s'
-    INSIGHTFACE_PROVIDERS = ['CPUExecutionProvider'] # Or ['CUDAExecutionProvider']
-    INSIGHTFACE_CTX_ID = -1 # 0 for GPU, -1 for CPU
+    INSIGHTFACE_PROVIDERS = ['CPUExecutionProvider'] # Or ['CUDAExecutionProvider'], which also selects the device
+    INSIGHTFACE_WARMUP = True # Run a dummy inference at startup so the first frame is not slow
+
+    # Cross-session micro-batching: recognition inference for frames arriving
+    # within INFERENCE_BATCH_WAIT seconds of each other runs as one batch
+    INFERENCE_BATCHING = True
+    INFERENCE_BATCH_SIZE = 32 # Max face crops per batch
+    INFERENCE_BATCH_WAIT = 0.005
+
+    # Copies of each model kept in a pool; every request checks one out, so
+    # simultaneous streams run inference in parallel. Each copy holds its own
+    # weights, and the cores are split between them unless
+    # ONNX_INTRA_OP_THREADS is set
+    INFERENCE_SESSION_POOL_SIZE = 1
+    # Threads running repository searches for the streaming pipeline
+    REPOSITORY_IO_THREADS = 8
+
+    # ONNX Runtime session options
+    ONNX_INTRA_OP_THREADS = 0 # 0 lets ONNX Runtime decide
+    ONNX_INTER_OP_THREADS = 0
+    ONNX_GRAPH_OPTIMIZATION_LEVEL = 'ORT_ENABLE_ALL' # Or 'ORT_ENABLE_EXTENDED', 'ORT_ENABLE_BASIC', 'ORT_DISABLE_ALL'
+    ONNX_OPTIMIZED_MODEL_DIR = '~/.insightface/optimized' # Cache of optimized graphs, None to disable
     FACE_SEARCH_THRESHOLD = 0.75
+
+    # Face detection
+    DETECTION_SIZE = (640, 640) # Detector input size, multiples of 32. Larger finds smaller/farther faces
+    DETECTION_THRESHOLD = 0.5
+    # Adaptive detection: most frames run at ADAPTIVE_DETECTION_LOW_SIZE plus a
+    # pass around the faces seen in the previous frame, with a full
+    # DETECTION_SIZE pass every ADAPTIVE_DETECTION_FULL_INTERVAL frames
+    ADAPTIVE_DETECTION = False
+    ADAPTIVE_DETECTION_LOW_SIZE = (320, 320)
+    ADAPTIVE_DETECTION_ROI_SIZE = (160, 160)
+    ADAPTIVE_DETECTION_ROI_MARGIN = 0.5 # Region padding, as a fraction of the face size
+    ADAPTIVE_DETECTION_FULL_INTERVAL = 10
+
+    # Quality gate between detection and recognition: faces that are too
+    # small, low-confidence, turned away or blurred are labeled as low
+    # quality instead of being embedded and searched
+    QUALITY_FILTER = True
+    QUALITY_MIN_FACE_SIZE = 40 # Pixels, shorter side of the bounding box
+    QUALITY_MIN_DET_SCORE = 0.6
+    QUALITY_MAX_YAW = 0.6 # Nose asymmetry between the eyes, 0 frontal to 1 profile
+    QUALITY_PITCH_RANGE = (0.2, 0.8) # Nose height between the eyes and the mouth
+    QUALITY_MIN_SHARPNESS = 25.0 # Variance of the Laplacian of the face crop
+    QUALITY_BLUR_CROP_SIZE = 112 # Crop side the sharpness is measured at
+    QUALITY_BLUR_INSET = 0.1 # Fraction of the box trimmed from each side before measuring sharpness
+
+    # Local embedding index: keeps every registered embedding in memory so a
+    # whole frame is resolved with one matrix multiply instead of one
+    # $vectorSearch round trip per face. MongoDB stays the source of truth.
+    USE_LOCAL_EMBEDDING_INDEX = False
+
+    # Near-duplicate search cache in front of $vectorSearch: consecutive frames
+    # of the same person reuse the previous result when their embeddings are
+    # within SEARCH_CACHE_TOLERANCE cosine distance
+    SEARCH_CACHE_ENABLED = True
+    SEARCH_CACHE_SIZE = 1024 # Max cached results (LRU)
+    SEARCH_CACHE_TTL = 5.0 # Seconds a cached result stays valid
+    SEARCH_CACHE_TOLERANCE = 0.05 # Max cosine distance to reuse a cached result
+    SEARCH_CACHE_HASH_BITS = 12 # LSH bits; fewer bits mean larger buckets and more hits
+
+    # Cache registered names and the document count in memory, updated by the
+    # repository's own writes and optionally by a change stream (needs a
+    # replica set) to follow writes from other processes
+    NAME_REGISTRY_CACHE = True
+    NAME_REGISTRY_CHANGE_STREAM = False
+
+    # Embedding storage: 'float32' or 'int8' packed BSON binary vectors, or
+    # 'list' for the legacy array of doubles. Existing collections can be
+    # converted with `python -m cli.migrate_vectors`
+    VECTOR_STORAGE_FORMAT = 'float32'
+
+    # Identity templates: an identity keeps up to IDENTITY_MAX_MEMBERS
+    # embeddings and is searched through their centroid. Candidates within
+    # IDENTITY_RERANK_MARGIN of FACE_SEARCH_THRESHOLD are re-ranked by their
+    # closest member. With IDENTITY_AUTO_ENROLL, predictions scoring at least
+    # IDENTITY_AUTO_ENROLL_SIMILARITY are added as members
+    IDENTITY_MAX_MEMBERS = 10
+    IDENTITY_MEMBER_DEDUP_SIMILARITY = 0.95 # Cosine; closer samples add nothing and are skipped
+    IDENTITY_RERANK_MARGIN = 0.1
+    IDENTITY_AUTO_ENROLL = False
+    IDENTITY_AUTO_ENROLL_SIMILARITY = 0.85
+    IDENTITY_AUTO_ENROLL_INTERVAL = 60.0 # Seconds between automatic samples per identity
+
+    # Atlas $vectorSearch parameters
+    VECTOR_SEARCH_NUM_CANDIDATES = 10
+    VECTOR_SEARCH_LIMIT = 3 # Identity centroids re-ranked against their members
+    VECTOR_SEARCH_MAX_CONCURRENCY = 8 # Parallel queries when searching a whole frame
     
+    # Face tracking: recognition only runs for new, drifted or stale tracks
+    TRACK_IOU_THRESHOLD = 0.3 # Min IoU to associate a detection with a track
+    TRACK_DRIFT_IOU = 0.5 # Re-recognize when IoU with the last verified box drops below this
+    TRACK_REVERIFY_FRAMES = 30 # Re-recognize after this many frames without confirmation
+    TRACK_MAX_MISSED = 10 # Frames a lost track is kept for re-identification
+    TRACK_REID_SIMILARITY = 0.6 # Cosine similarity needed to re-identify a lost track
+
+    # Annotation rendering: pre-rendered label sprites kept per (text, color)
+    RENDER_LABEL_CACHE_SIZE = 256
+
+    # Metrics
+    METRICS_WINDOW = 1000 # Observations kept per histogram for percentiles
+    METRICS_PATH = '/metrics' # Prometheus endpoint served next to the Gradio app
+    METRICS_REFRESH_INTERVAL = 2 # Seconds between stats panel refreshes
+
     # Gradio streaming interval
     STREAM_INTERVAL = 0.1
+    # Process predictions on a per-session background thread, dropping frames
+    # that arrive while the previous one is still being processed
+    STREAM_BACKGROUND_WORKER = True
+
+    # Load governor: when the p95 frame latency exceeds GOVERNOR_TARGET_LATENCY
+    # or more than GOVERNOR_MAX_DROP_RATIO of the streamed frames are dropped,
+    # processing steps down to the next level, and it steps back up when both
+    # fall below GOVERNOR_HEADROOM of their limits. Every model used by a
+    # level is loaded at startup and keeps its own gallery; registrations
+    # are embedded with each of them. Levels whose model gallery has fewer
+    # identities than the main one are disabled at startup. A ':int8' suffix
+    # runs the pack with a quantized recognition model.
+    GOVERNOR_ENABLED = False
+    GOVERNOR_LEVELS = [
+        {'detection_size': DETECTION_SIZE, 'stream_interval': STREAM_INTERVAL, 'model': INSIGHTFACE_MODEL_NAME},
+        {'detection_size': (480, 480), 'stream_interval': 0.2, 'model': INSIGHTFACE_MODEL_NAME},
+        {'detection_size': (320, 320), 'stream_interval': 0.3, 'model': 'buffalo_s'},
+    ]
+    GOVERNOR_TARGET_LATENCY = 0.25 # Seconds
+    GOVERNOR_MAX_DROP_RATIO = 0.5
+    GOVERNOR_HEADROOM = 0.5
+    GOVERNOR_WINDOW = 100 # Frames measured per decision
+    GOVERNOR_MIN_SAMPLES = 20
+    GOVERNOR_COOLDOWN = 10.0 # Seconds between level changes
 
 # Validate required environment variables
 def validate_required_env_vars():
-    required_vars = [
-        'MONGO_URI',
-        'DATABASE_NAME',
-        'COLLECTION_NAME',
-        'VECTOR_SEARCH_INDEX_NAME',
-        'VECTOR_SEARCH_FIELD_PATH',
-        'ADMIN_PASSWORD',
-    ]
+    required_vars = ['ADMIN_PASSWORD']
+    if Config.FACE_REPOSITORY_BACKEND == 'mongo':
+        required_vars += [
+            'MONGO_URI',
+            'DATABASE_NAME',
+            'COLLECTION_NAME',
+            'VECTOR_SEARCH_INDEX_NAME',
+            'VECTOR_SEARCH_FIELD_PATH',
+        ]
     
     for var in required_vars:
         if getattr(Config, var) is None:
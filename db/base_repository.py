@@ -0,0 +1,42 @@
+from abc import ABC, abstractmethod
+import numpy as np
+
+class BaseFaceRepository(ABC):
+    '''
+    Storage backend for registered faces. Search results are
+    (name, score, match) tuples, where the score follows Atlas cosine
+    scoring, (1 + cos) / 2, and `match` applies FACE_SEARCH_THRESHOLD.
+    An identity is a template of several member embeddings, searched
+    through their centroid (see db.identity_templates).
+    '''
+
+    @abstractmethod
+    def insert_embedding(self, name: str, emb: np.ndarray) -> None: ...
+
+    @abstractmethod
+    def insert_embeddings(self, items: list[tuple[str, np.ndarray]]) -> int: ...
+
+    @abstractmethod
+    def add_member(self, name: str, emb: np.ndarray) -> bool:
+        '''Adds an embedding to the identity's template; False if unknown or a near duplicate.'''
+
+    @abstractmethod
+    def is_name_taken(self, name: str) -> bool: ...
+
+    @abstractmethod
+    def update_name(self, old_name: str, new_name: str) -> bool: ...
+
+    @abstractmethod
+    def delete_name(self, name: str) -> bool: ...
+
+    @abstractmethod
+    def get_all_names(self) -> list[str]: ...
+
+    @abstractmethod
+    def get_count(self) -> int: ...
+
+    @abstractmethod
+    def search_faces(self, embeddings: list[np.ndarray]) -> list[tuple[str, float, bool]]: ...
+
+    def search_face(self, embedding_to_check: np.ndarray) -> tuple[str, float, bool]:
+        return self.search_faces([embedding_to_check])[0]
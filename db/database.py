@@ -18,5 +18,5 @@ class MongoDB:
         return cls._db
 
     @classmethod
-    def get_embeddings_collection(cls):
-        return cls.get_db()[Config.COLLECTION_NAME]
\ No newline at end of file
+    def get_embeddings_collection(cls, name: str | None = None):
+        return cls.get_db()[name or Config.COLLECTION_NAME]
\ No newline at end of file
@@ -0,0 +1,121 @@
+import threading
+import numpy as np
+from config import Config
+from db.vector_codec import decode_vector
+
+class EmbeddingIndex:
+    '''
+    In-memory copy of the registered embeddings, kept as an L2-normalized
+    float32 matrix with a parallel list of names. MongoDB remains the source
+    of truth; the repository keeps this index in sync on every write.
+    Identity template members, when loaded, are kept alongside so that
+    re-ranking does not go back to the database.
+    '''
+
+    def __init__(self, dim: int = 512):
+        self._lock = threading.Lock()
+        self._matrix = np.empty((16, dim), dtype=np.float32)
+        self._names: list[str] = []
+        self._members: dict[str, list[np.ndarray]] = {}
+
+    @classmethod
+    def from_collection(cls, collection, field_path: str, members_field: str | None = None) -> 'EmbeddingIndex':
+        index = cls()
+        projection = {'name': 1, field_path: 1, '_id': 0}
+        if members_field:
+            projection[members_field] = 1
+        for doc in collection.find({}, projection):
+            if doc.get(field_path) is not None:
+                index.add(doc['name'], decode_vector(doc[field_path]))
+                if members_field and doc.get(members_field):
+                    index.set_members(doc['name'], [decode_vector(v) for v in doc[members_field]])
+        return index
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, name: str, emb: np.ndarray) -> None:
+        vector = self._normalize(emb.reshape(-1))
+        with self._lock:
+            size = len(self._names)
+            if size == self._matrix.shape[0]:
+                grown = np.empty((size * 2, self._matrix.shape[1]), dtype=np.float32)
+                grown[:size] = self._matrix
+                self._matrix = grown
+            self._matrix[size] = vector
+            self._names.append(name)
+
+    def rename(self, old_name: str, new_name: str) -> None:
+        # Mirrors update_one: only the first matching entry is renamed
+        with self._lock:
+            if old_name in self._names:
+                self._names[self._names.index(old_name)] = new_name
+                if old_name in self._members:
+                    self._members[new_name] = self._members.pop(old_name)
+
+    def set_members(self, name: str, members: list[np.ndarray]) -> None:
+        with self._lock:
+            self._members[name] = list(members)
+
+    def members(self, name: str) -> list[np.ndarray] | None:
+        with self._lock:
+            return self._members.get(name)
+
+    def get(self, name: str) -> np.ndarray | None:
+        '''Returns a copy of the first normalized vector stored for `name`.'''
+        with self._lock:
+            if name not in self._names:
+                return None
+            return self._matrix[self._names.index(name)].copy()
+
+    def remove(self, name: str) -> None:
+        # Mirrors delete_one: only the first matching entry is removed
+        with self._lock:
+            if name not in self._names:
+                return
+            pos = self._names.index(name)
+            size = len(self._names)
+            self._matrix[pos:size - 1] = self._matrix[pos + 1:size]
+            del self._names[pos]
+            if name not in self._names:
+                self._members.pop(name, None)
+
+    def top_k(self, embeddings: np.ndarray, k: int = 1) -> list[list[tuple[str, float]]]:
+        '''
+        Returns the k best (name, score) pairs for every query embedding.
+        Scores follow Atlas $vectorSearch cosine scoring: (1 + cos) / 2.
+        '''
+        queries = self._normalize(np.atleast_2d(embeddings))
+        with self._lock:
+            size = len(self._names)
+            if size == 0 or queries.shape[0] == 0:
+                return [[] for _ in range(queries.shape[0])]
+            scores = queries @ self._matrix[:size].T
+            k = min(k, size)
+            if k == 1:
+                best = scores.argmax(axis=1)[:, None]
+            else:
+                best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                order = np.take_along_axis(scores, best, axis=1).argsort(axis=1)[:, ::-1]
+                best = np.take_along_axis(best, order, axis=1)
+
+            return [
+                [(self._names[j], float((1 + scores[i, j]) / 2)) for j in row]
+                for i, row in enumerate(best)
+            ]
+
+    def search(self, embeddings: np.ndarray) -> list[tuple[str, float, bool]]:
+        results = []
+        for matches in self.top_k(embeddings, k=1):
+            if matches:
+                name, score = matches[0]
+                results.append((name, score, score >= Config.FACE_SEARCH_THRESHOLD))
+            else:
+                results.append(('', 0, False))
+        return results
@@ -0,0 +1,47 @@
+import numpy as np
+from config import Config
+
+# Identity templates: every identity keeps a capped set of member embeddings
+# (registration frames and confirmed predictions) and is searched through the
+# normalized centroid of its members, so the search set stays at one vector
+# per person. Candidates close to a match are re-ranked against their members.
+
+def normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+def centroid(members: list[np.ndarray]) -> np.ndarray:
+    return normalize(np.mean([normalize(m) for m in members], axis=0))
+
+def add_member(members: list[np.ndarray], emb: np.ndarray) -> list[np.ndarray] | None:
+    '''
+    Returns the member list with `emb` added, or None when it is a near
+    duplicate of an existing member. The first member (the registration
+    snapshot) is always kept; beyond IDENTITY_MAX_MEMBERS the oldest of the
+    others is dropped.
+    '''
+    vector = normalize(emb)
+    if any(float(normalize(m) @ vector) >= Config.IDENTITY_MEMBER_DEDUP_SIMILARITY for m in members):
+        return None
+    updated = list(members) + [vector]
+    if len(updated) > Config.IDENTITY_MAX_MEMBERS:
+        del updated[1]
+    return updated
+
+def needs_rerank(score: float) -> bool:
+    return score >= Config.FACE_SEARCH_THRESHOLD - Config.IDENTITY_RERANK_MARGIN
+
+def rerank(query: np.ndarray, candidates: list[tuple[str, float, list[np.ndarray] | None]]) -> tuple[str, float, bool]:
+    '''
+    Picks the best of the centroid search's (name, score, members)
+    candidates. Candidates scoring within IDENTITY_RERANK_MARGIN of the
+    threshold are scored by their closest member instead, when better.
+    '''
+    vector = normalize(query)
+    best_name, best_score = '', 0.0
+    for name, score, members in candidates:
+        if members and needs_rerank(score):
+            score = max(score, max(float((1 + normalize(m) @ vector) / 2) for m in members))
+        if score > best_score:
+            best_name, best_score = name, score
+    return best_name, best_score, best_score >= Config.FACE_SEARCH_THRESHOLD
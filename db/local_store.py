@@ -0,0 +1,364 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from config import Config
+from db import identity_templates
+from db.base_repository import BaseFaceRepository
+from metrics import metrics
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class IVFIndex:
+    '''
+    Inverted-file index: rows are bucketed by their nearest k-means centroid
+    and a search only scores the rows in the `nprobe` closest buckets.
+    Rows appended after the index was built (`built_rows` onwards) are not
+    bucketed and are always scored exhaustively.
+    '''
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, built_rows: int):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.built_rows = built_rows
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: int, iterations: int = 10, sample_size: int = 50_000, seed: int = 0) -> 'IVFIndex':
+        rows = matrix.shape[0]
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(nlist, rows))
+
+        # Spherical k-means on a sample, since rows are unit vectors
+        sample = np.asarray(matrix[np.sort(rng.choice(rows, min(rows, sample_size), replace=False))])
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = (sample @ centroids.T).argmax(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            filled = np.bincount(assignment, minlength=nlist) > 0
+            centroids[filled] = _normalize(sums[filled])
+
+        assignment = np.empty(rows, dtype=np.int32)
+        for start in range(0, rows, 65_536):
+            chunk = np.asarray(matrix[start:start + 65_536])
+            assignment[start:start + chunk.shape[0]] = (chunk @ centroids.T).argmax(axis=1)
+
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        return cls(centroids, order, offsets, rows)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = min(nprobe, self.centroids.shape[0])
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in probe])
+
+    def save(self, path: str) -> None:
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(
+            tmp_path, centroids=self.centroids, order=self.order,
+            offsets=self.offsets, built_rows=self.built_rows
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFIndex':
+        with np.load(path) as data:
+            return cls(data['centroids'], data['order'], data['offsets'], int(data['built_rows']))
+
+class LocalFaceRepository(BaseFaceRepository):
+    '''
+    Offline backend that keeps embeddings in a memory-mapped float32 file
+    (`embeddings.f32`, one L2-normalized row per registration) next to a name
+    table (`names.json`). The matrix is never copied into RAM; the OS pages
+    it in on demand. Large galleries are searched through an IVF index.
+    Deleted rows are tombstoned and removed by `compact`.
+    An identity's row holds its template centroid; the template members are
+    kept per identity under `members/`, and adding one replaces the row.
+    '''
+
+    def __init__(self, path: str | None = None, dim: int = 512):
+        self.path = os.path.expanduser(path or Config.LOCAL_STORE_PATH)
+        os.makedirs(self.path, exist_ok=True)
+        self._vectors_file = os.path.join(self.path, 'embeddings.f32')
+        self._names_file = os.path.join(self.path, 'names.json')
+        self._ivf_file = os.path.join(self.path, 'ivf.npz')
+        self._members_dir = os.path.join(self.path, 'members')
+        self._members: dict[str, list[np.ndarray] | None] = {} # Loaded member files, None if absent
+        self._lock = threading.RLock()
+        self._rebuilding = False
+        self._generation = 0 # Bumped by compaction, which renumbers rows
+
+        self.dim = dim
+        self.names: list[str | None] = []
+        if os.path.exists(self._names_file):
+            with open(self._names_file) as f:
+                table = json.load(f)
+            self.dim, self.names = table['dim'], table['names']
+
+        self._valid = np.array([name is not None for name in self.names], dtype=bool)
+        self._rows_by_name: dict[str, list[int]] = {}
+        for row, name in enumerate(self.names):
+            if name is not None:
+                self._rows_by_name.setdefault(name, []).append(row)
+
+        self._open_matrix()
+
+        self.ivf = None
+        if os.path.exists(self._ivf_file):
+            ivf = IVFIndex.load(self._ivf_file)
+            if ivf.built_rows <= len(self.names):
+                self.ivf = ivf
+        self._maybe_rebuild_index()
+        print(f'Opened local face store at {self.path} ({self.get_count()} embeddings).')
+
+    def _open_matrix(self) -> None:
+        rows = len(self.names)
+        row_bytes = self.dim * 4
+        # Rows written before an interrupted name table update are discarded
+        if os.path.exists(self._vectors_file) and os.path.getsize(self._vectors_file) > rows * row_bytes:
+            os.truncate(self._vectors_file, rows * row_bytes)
+
+        if rows == 0:
+            self.matrix = np.empty((0, self.dim), dtype=np.float32)
+        else:
+            self.matrix = np.memmap(self._vectors_file, dtype='<f4', mode='r', shape=(rows, self.dim))
+
+    def _save_names(self) -> None:
+        tmp_path = f'{self._names_file}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'dim': self.dim, 'names': self.names}, f, separators=(',', ':'))
+        os.replace(tmp_path, self._names_file)
+
+    def _append(self, items: list[tuple[str, np.ndarray]]) -> None:
+        vectors = _normalize(np.stack([emb.reshape(-1) for _, emb in items]))
+        with self._lock:
+            with open(self._vectors_file, 'ab') as f:
+                f.write(vectors.astype('<f4').tobytes())
+            start = len(self.names)
+            for offset, (name, _) in enumerate(items):
+                self.names.append(name)
+                self._rows_by_name.setdefault(name, []).append(start + offset)
+            self._valid = np.concatenate([self._valid, np.ones(len(items), dtype=bool)])
+            self._save_names()
+            self._open_matrix()
+        self._maybe_rebuild_index()
+
+    def _members_file(self, name: str) -> str:
+        return os.path.join(self._members_dir, f'{hashlib.sha1(name.encode()).hexdigest()}.npy')
+
+    def _load_members(self, name: str) -> list[np.ndarray] | None:
+        # Member files are read once and cached, so searches stay off the disk
+        if name not in self._members:
+            path = self._members_file(name)
+            self._members[name] = list(np.load(path)) if os.path.exists(path) else None
+        return self._members[name]
+
+    def _save_members(self, name: str, members: list[np.ndarray]) -> None:
+        os.makedirs(self._members_dir, exist_ok=True)
+        path = self._members_file(name)
+        tmp_path = f'{path}.tmp.npy'
+        np.save(tmp_path, np.stack(members).astype(np.float32))
+        os.replace(tmp_path, path)
+        self._members[name] = list(members)
+
+    def _should_compact(self) -> bool:
+        deleted = len(self.names) - int(self._valid.sum())
+        return deleted >= 1000 and deleted > len(self.names) * 0.2
+
+    def _maybe_rebuild_index(self) -> None:
+        rows = len(self.names)
+        if rows < Config.LOCAL_STORE_IVF_MIN_SIZE or self._rebuilding:
+            return
+        if self.ivf is not None and rows - self.ivf.built_rows <= self.ivf.built_rows * 0.1:
+            return
+
+        self._rebuilding = True
+        threading.Thread(target=self._rebuild_index, name='ivf-rebuild', daemon=True).start()
+
+    def _rebuild_index(self) -> None:
+        try:
+            with self._lock:
+                matrix, generation = self.matrix, self._generation
+            nlist = Config.LOCAL_STORE_IVF_LISTS or int(4 * np.sqrt(matrix.shape[0]))
+            ivf = IVFIndex.build(matrix, nlist)
+            with self._lock:
+                # A compaction during the build invalidates the row numbers
+                if generation == self._generation:
+                    ivf.save(self._ivf_file)
+                    self.ivf = ivf
+            print(f'Built IVF index over {ivf.built_rows} embeddings ({len(ivf.centroids)} lists).')
+        except Exception as e:
+            print(f'Error building IVF index: {e}')
+        finally:
+            self._rebuilding = False
+
+    def build_index(self) -> None:
+        '''Builds the IVF index synchronously, if the gallery is large enough.'''
+        if len(self.names) >= Config.LOCAL_STORE_IVF_MIN_SIZE:
+            self._rebuilding = True
+            self._rebuild_index()
+
+    def compact(self) -> None:
+        '''Rewrites the store without deleted rows.'''
+        with self._lock:
+            keep = np.flatnonzero(self._valid)
+            tmp_path = f'{self._vectors_file}.tmp'
+            with open(tmp_path, 'wb') as f:
+                for start in range(0, len(keep), 65_536):
+                    f.write(np.asarray(self.matrix[keep[start:start + 65_536]], dtype='<f4').tobytes())
+            os.replace(tmp_path, self._vectors_file)
+
+            self.names = [self.names[row] for row in keep]
+            self._valid = np.ones(len(self.names), dtype=bool)
+            self._rows_by_name = {}
+            for row, name in enumerate(self.names):
+                self._rows_by_name.setdefault(name, []).append(row)
+            self._save_names()
+            self._open_matrix()
+            self.ivf = None
+            self._generation += 1
+            if os.path.exists(self._ivf_file):
+                os.remove(self._ivf_file)
+        self._maybe_rebuild_index()
+
+    @metrics.timed('repository.insert_embedding')
+    def insert_embedding(self, name: str, emb: np.ndarray) -> None:
+        self._append([(name, emb)])
+
+    @metrics.timed('repository.insert_embeddings')
+    def insert_embeddings(self, items: list[tuple[str, np.ndarray]]) -> int:
+        if not items:
+            return 0
+        self._append(items)
+        return len(items)
+
+    @metrics.timed('repository.add_member')
+    def add_member(self, name: str, emb: np.ndarray) -> bool:
+        with self._lock:
+            rows = self._rows_by_name.get(name)
+            if not rows:
+                return False
+            members = self._load_members(name) or [np.asarray(self.matrix[rows[0]])]
+            updated = identity_templates.add_member(members, emb)
+            if updated is None:
+                return False
+            self._save_members(name, updated)
+
+            # Rows are append-only, so the new centroid is appended and the
+            # previous one tombstoned
+            row = rows.pop(0)
+            if not rows:
+                del self._rows_by_name[name]
+            self.names[row] = None
+            self._valid[row] = False
+            self._append([(name, identity_templates.centroid(updated))])
+            should_compact = self._should_compact()
+        if should_compact:
+            self.compact()
+        return True
+
+    @metrics.timed('repository.is_name_taken')
+    def is_name_taken(self, name: str) -> bool:
+        return name in self._rows_by_name
+
+    @metrics.timed('repository.update_name')
+    def update_name(self, old_name: str, new_name: str) -> bool:
+        # Like the MongoDB backend, only the first matching entry is renamed
+        with self._lock:
+            rows = self._rows_by_name.get(old_name)
+            if not rows or old_name == new_name:
+                return False
+            row = rows.pop(0)
+            if not rows:
+                del self._rows_by_name[old_name]
+            self.names[row] = new_name
+            self._rows_by_name.setdefault(new_name, []).append(row)
+            self._save_names()
+            if os.path.exists(self._members_file(old_name)):
+                os.replace(self._members_file(old_name), self._members_file(new_name))
+            self._members.pop(old_name, None)
+            self._members.pop(new_name, None)
+            return True
+
+    @metrics.timed('repository.delete_name')
+    def delete_name(self, name: str) -> bool:
+        with self._lock:
+            rows = self._rows_by_name.get(name)
+            if not rows:
+                return False
+            row = rows.pop(0)
+            if not rows:
+                del self._rows_by_name[name]
+            self.names[row] = None
+            self._valid[row] = False
+            self._save_names()
+            if name not in self._rows_by_name:
+                self._members.pop(name, None)
+                if os.path.exists(self._members_file(name)):
+                    os.remove(self._members_file(name))
+            should_compact = self._should_compact()
+        if should_compact:
+            self.compact()
+        return True
+
+    @metrics.timed('repository.get_all_names')
+    def get_all_names(self) -> list[str]:
+        with self._lock:
+            return sorted(name for name in self.names if name is not None)
+
+    @metrics.timed('repository.get_count')
+    def get_count(self) -> int:
+        return int(self._valid.sum())
+
+    @metrics.timed('repository.search_faces')
+    def search_faces(self, embeddings: list[np.ndarray]) -> list[tuple[str, float, bool]]:
+        if not embeddings:
+            return []
+        queries = _normalize(np.stack([emb.reshape(-1) for emb in embeddings]))
+
+        with self._lock:
+            rows = len(self.names)
+            if rows == 0 or not self._valid.any():
+                return [('', 0, False) for _ in embeddings]
+
+            # Top VECTOR_SEARCH_LIMIT centroid rows and cosines per query
+            top = []
+            if self.ivf is None:
+                scores = queries @ self.matrix.T
+                scores[:, ~self._valid] = -np.inf
+                for query_scores in scores:
+                    top.append(self._top_k(np.arange(rows), query_scores))
+            else:
+                tail = np.arange(self.ivf.built_rows, rows)
+                for query in queries:
+                    candidates = np.concatenate([self.ivf.candidates(query, Config.LOCAL_STORE_IVF_NPROBE), tail])
+                    candidates = candidates[self._valid[candidates]]
+                    if candidates.size == 0:
+                        candidates = np.flatnonzero(self._valid)
+                    top.append(self._top_k(candidates, self.matrix[candidates] @ query))
+
+            candidates = [
+                [(self.names[row], float((1 + cos) / 2)) for row, cos in matches]
+                for matches in top
+            ]
+            close = {
+                name for matches in candidates for name, score in matches
+                if identity_templates.needs_rerank(score)
+            }
+            members = {name: self._load_members(name) for name in close}
+
+        return [
+            identity_templates.rerank(query, [(name, score, members.get(name)) for name, score in matches])
+            for query, matches in zip(queries, candidates)
+        ]
+
+    @staticmethod
+    def _top_k(rows: np.ndarray, scores: np.ndarray) -> list[tuple[int, float]]:
+        k = min(Config.VECTOR_SEARCH_LIMIT, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k]
+        return [(int(rows[j]), float(scores[j])) for j in best if np.isfinite(scores[j])]
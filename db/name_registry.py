@@ -0,0 +1,93 @@
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+class NameRegistry:
+    '''
+    Write-through cache of the registered names: a sorted list of unique
+    names, O(1) membership checks and a maintained document count.
+    Updates are keyed by document id, so applying the same change from the
+    repository and from a change stream is idempotent.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names_by_id: dict = {}
+        self._counts: Counter = Counter()
+        self._sorted: list[str] = []
+        self._watcher = None
+
+    @classmethod
+    def from_collection(cls, collection) -> 'NameRegistry':
+        registry = cls()
+        for doc in collection.find({}, {'name': 1}):
+            registry.add(doc['_id'], doc['name'])
+        return registry
+
+    def _add_name(self, name: str) -> None:
+        self._counts[name] += 1
+        if self._counts[name] == 1:
+            insort(self._sorted, name)
+
+    def _remove_name(self, name: str) -> None:
+        self._counts[name] -= 1
+        if self._counts[name] <= 0:
+            del self._counts[name]
+            del self._sorted[bisect_left(self._sorted, name)]
+
+    def add(self, doc_id, name: str) -> None:
+        with self._lock:
+            current = self._names_by_id.get(doc_id)
+            if current == name:
+                return
+            if current is not None:
+                self._remove_name(current)
+            self._names_by_id[doc_id] = name
+            self._add_name(name)
+
+    def remove(self, doc_id) -> None:
+        with self._lock:
+            name = self._names_by_id.pop(doc_id, None)
+            if name is not None:
+                self._remove_name(name)
+
+    def contains(self, name: str) -> bool:
+        return name in self._counts
+
+    def names(self) -> list[str]:
+        with self._lock:
+            return list(self._sorted)
+
+    def count(self) -> int:
+        return len(self._names_by_id)
+
+    def watch(self, collection) -> None:
+        '''
+        Follows a MongoDB change stream so that writes from other processes
+        (e.g. bulk enrollment) are reflected. Requires a replica set.
+        '''
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(
+            target=self._follow, args=(collection,), name='name-registry-watch', daemon=True
+        )
+        self._watcher.start()
+
+    def _follow(self, collection) -> None:
+        try:
+            with collection.watch(full_document='updateLookup') as stream:
+                for change in stream:
+                    doc_id = change['documentKey']['_id']
+                    operation = change['operationType']
+                    if operation == 'delete':
+                        self.remove(doc_id)
+                    elif operation in ('insert', 'update', 'replace'):
+                        document = change.get('fullDocument')
+                        if document is None:
+                            self.remove(doc_id)
+                        elif 'name' in document:
+                            self.add(doc_id, document['name'])
+        except Exception as e:
+            print(f'Name registry change stream stopped: {e}')
+        finally:
+            self._watcher = None
@@ -1,67 +1,267 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from db.base_repository import BaseFaceRepository
 from db.database import MongoDB
+from db import identity_templates
+from db.embedding_index import EmbeddingIndex
+from db.name_registry import NameRegistry
+from db.search_cache import SearchCache
+from db.vector_codec import decode_vector, encode_vector
 from config import Config
+from metrics import metrics
 
-class FaceRepository:
-    def __init__(self):
-        self.collection = MongoDB.get_embeddings_collection()
+MEMBERS_FIELD = 'members'
 
+class FaceRepository(BaseFaceRepository):
+    '''
+    One document per identity: the centroid under VECTOR_SEARCH_FIELD_PATH,
+    which the vector search index covers, and the member embeddings under
+    `members`. Documents written before templates existed have no members
+    and are treated as single-member identities.
+    '''
+
+    def __init__(self, collection_name: str | None = None):
+        self.collection = MongoDB.get_embeddings_collection(collection_name)
+        self.index = None
+        self.cache = SearchCache() if Config.SEARCH_CACHE_ENABLED else None
+        self._search_executor = ThreadPoolExecutor(
+            max_workers=Config.VECTOR_SEARCH_MAX_CONCURRENCY,
+            thread_name_prefix='vector-search'
+        )
+
+        if Config.USE_LOCAL_EMBEDDING_INDEX:
+            self.index = EmbeddingIndex.from_collection(
+                self.collection, Config.VECTOR_SEARCH_FIELD_PATH, MEMBERS_FIELD
+            )
+            print(f'Loaded {len(self.index)} embeddings into the local index.')
+
+        self.registry = None
+        if Config.NAME_REGISTRY_CACHE:
+            self.registry = NameRegistry.from_collection(self.collection)
+            if Config.NAME_REGISTRY_CHANGE_STREAM:
+                self.registry.watch(self.collection)
+
+    @metrics.timed('repository.insert_embedding')
     def insert_embedding(self, name: str, emb: np.ndarray) -> None:
-        self.collection.insert_one({
+        result = self.collection.insert_one({
             'name': name,
-            Config.VECTOR_SEARCH_FIELD_PATH: emb.flatten().tolist()
+            Config.VECTOR_SEARCH_FIELD_PATH: encode_vector(emb),
+            MEMBERS_FIELD: [encode_vector(emb)]
         })
+        if self.registry is not None:
+            self.registry.add(result.inserted_id, name)
+        if self.index is not None:
+            self.index.add(name, emb)
+        if self.cache:
+            self.cache.invalidate_insert(emb)
+
+    @metrics.timed('repository.insert_embeddings')
+    def insert_embeddings(self, items: list[tuple[str, np.ndarray]]) -> int:
+        if not items:
+            return 0
+        result = self.collection.insert_many(
+            [
+                {
+                    'name': name,
+                    Config.VECTOR_SEARCH_FIELD_PATH: encode_vector(emb),
+                    MEMBERS_FIELD: [encode_vector(emb)]
+                }
+                for name, emb in items
+            ],
+            ordered=False
+        )
+        for doc_id, (name, emb) in zip(result.inserted_ids, items):
+            if self.registry is not None:
+                self.registry.add(doc_id, name)
+            if self.index is not None:
+                self.index.add(name, emb)
+            if self.cache:
+                self.cache.invalidate_insert(emb)
+        return len(result.inserted_ids)
 
+    @metrics.timed('repository.add_member')
+    def add_member(self, name: str, emb: np.ndarray) -> bool:
+        field = Config.VECTOR_SEARCH_FIELD_PATH
+        # Optimistic concurrency: the update only applies if no other writer
+        # changed the template since it was read
+        for _ in range(3):
+            doc = self.collection.find_one({'name': name}, {field: 1, MEMBERS_FIELD: 1, 'version': 1})
+            if doc is None:
+                return False
+            members = [decode_vector(v) for v in doc.get(MEMBERS_FIELD) or [doc[field]]]
+            updated = identity_templates.add_member(members, emb)
+            if updated is None:
+                return False
+
+            center = identity_templates.centroid(updated)
+            version = doc.get('version')
+            result = self.collection.update_one(
+                {'_id': doc['_id'], 'version': version},
+                {'$set': {
+                    field: encode_vector(center),
+                    MEMBERS_FIELD: [encode_vector(m) for m in updated],
+                    'version': (version or 0) + 1,
+                }}
+            )
+            if result.modified_count:
+                break
+        else:
+            return False
+
+        if self.index is not None:
+            self.index.remove(name)
+            self.index.add(name, center)
+            self.index.set_members(name, updated)
+        if self.cache:
+            self.cache.invalidate_name(name)
+            self.cache.invalidate_insert(emb)
+        return True
+
+    @metrics.timed('repository.is_name_taken')
     def is_name_taken(self, name: str) -> bool:
+        if self.registry is not None:
+            return self.registry.contains(name)
         return self.collection.find_one({'name': name}) is not None
 
+    @metrics.timed('repository.update_name')
     def update_name(self, old_name: str, new_name: str) -> bool:
-        return bool(
-            self.collection.update_one(
-                {'name': old_name},
-                {'$set': {'name': new_name}}
-            ).modified_count
+        # Returns the updated document's id so the registry can follow it
+        doc = self.collection.find_one_and_update(
+            {'name': old_name},
+            {'$set': {'name': new_name}},
+            projection={'_id': 1}
         )
+        modified = doc is not None
+        if modified and self.registry is not None:
+            self.registry.add(doc['_id'], new_name)
+        if modified and self.index is not None:
+            self.index.rename(old_name, new_name)
+        if modified and self.cache:
+            self.cache.invalidate_name(old_name)
+        return modified
 
+    @metrics.timed('repository.delete_name')
     def delete_name(self, name: str) -> bool:
-        return bool(
-            self.collection.delete_one(
-                {'name': name}
-            ).deleted_count
+        doc = self.collection.find_one_and_delete(
+            {'name': name},
+            projection={'_id': 1}
         )
+        deleted = doc is not None
+        if deleted and self.registry is not None:
+            self.registry.remove(doc['_id'])
+        if deleted and self.index is not None:
+            self.index.remove(name)
+        if deleted and self.cache:
+            self.cache.invalidate_name(name)
+        return deleted
 
+    @metrics.timed('repository.get_all_names')
     def get_all_names(self) -> list[str]:
+        if self.registry is not None:
+            return self.registry.names()
         res = self.collection.find({}, {'name': 1, '_id': 0})
         return sorted([x['name'] for x in res])
 
+    @metrics.timed('repository.get_count')
     def get_count(self) -> int:
+        if self.registry is not None:
+            return self.registry.count()
         return self.collection.count_documents({})
 
-    def search_face(self, embedding_to_check: np.ndarray) -> tuple[str, float, bool]:
+    @metrics.timed('repository.search_faces')
+    def search_faces(self, embeddings: list[np.ndarray]) -> list[tuple[str, float, bool]]:
+        if not embeddings:
+            return []
+        if self.index is not None:
+            return self._search_index(embeddings)
+
+        # Read before searching, so results that may predate a concurrent write are not cached
+        generation = self.cache.generation if self.cache else 0
+        results = [self.cache.get(emb) if self.cache else None for emb in embeddings]
+        misses = [i for i, result in enumerate(results) if result is None]
+
+        if len(misses) == 1:
+            fetched = [self._vector_search(embeddings[misses[0]])]
+        else:
+            # $vectorSearch takes a single query vector, so the frame's queries are
+            # fanned out concurrently over the pooled MongoClient connections.
+            # map() keeps the results in input order.
+            fetched = self._search_executor.map(self._vector_search, [embeddings[i] for i in misses])
+
+        for i, result in zip(misses, fetched):
+            results[i] = result
+            if self.cache:
+                self.cache.put(embeddings[i], result, generation)
+
+        if self.cache:
+            metrics.set_gauge('search_cache_hit_ratio', self.cache.hit_ratio)
+        return results
+
+    def _search_index(self, embeddings: list[np.ndarray]) -> list[tuple[str, float, bool]]:
+        candidates = self.index.top_k(
+            np.stack([emb.flatten() for emb in embeddings]), Config.VECTOR_SEARCH_LIMIT
+        )
+        # Members are kept in the index, so re-ranking needs no database round trip
+        return [
+            identity_templates.rerank(emb, [(name, score, self.index.members(name)) for name, score in matches])
+            for emb, matches in zip(embeddings, candidates)
+        ]
+
+    @metrics.timed('repository.vector_search')
+    def _vector_search(self, embedding_to_check: np.ndarray) -> tuple[str, float, bool]:
+        # The top VECTOR_SEARCH_LIMIT centroids are returned, with their
+        # members only when they are close enough to be re-ranked
+        rerank_score = Config.FACE_SEARCH_THRESHOLD - Config.IDENTITY_RERANK_MARGIN
         res = self.collection.aggregate([
             {
                 "$vectorSearch": {
                     "index": Config.VECTOR_SEARCH_INDEX_NAME,
                     "path": Config.VECTOR_SEARCH_FIELD_PATH,
-                    "queryVector": embedding_to_check.flatten().tolist(),
-                    "numCandidates": 10,
-                    "limit": 1
+                    "queryVector": encode_vector(embedding_to_check),
+                    "numCandidates": Config.VECTOR_SEARCH_NUM_CANDIDATES,
+                    "limit": Config.VECTOR_SEARCH_LIMIT
+                }
+            },
+            {
+                "$addFields": {
+                    "score": { "$meta": "vectorSearchScore" }
                 }
             },
             {
                 "$project": {
                     "name": 1,
-                    "score": { "$meta": "vectorSearchScore" }
+                    "score": 1,
+                    MEMBERS_FIELD: {
+                        "$cond": [{ "$gte": ["$score", rerank_score] }, f"${MEMBERS_FIELD}", "$$REMOVE"]
+                    }
                 }
             }
         ]).to_list()
 
-        if res:
-            match_res = res[0]
-            return (
-                match_res['name'], 
-                match_res['score'], 
-                match_res['score'] >= Config.FACE_SEARCH_THRESHOLD
-            )
-        
-        return '', 0, False
\ No newline at end of file
+        return identity_templates.rerank(embedding_to_check, [
+            (doc['name'], doc['score'], [decode_vector(v) for v in doc.get(MEMBERS_FIELD) or []])
+            for doc in res
+        ])
+
+def gallery_suffix(model_name: str | None) -> str | None:
+    '''
+    Embeddings from different models are not comparable, so every model
+    other than INSIGHTFACE_MODEL_NAME keeps its own gallery.
+    '''
+    if model_name is None or model_name == Config.INSIGHTFACE_MODEL_NAME:
+        return None
+    return model_name.replace(':', '_')
+
+def create_face_repository(model_name: str | None = None) -> BaseFaceRepository:
+    '''
+    Creates the repository for the configured FACE_REPOSITORY_BACKEND, for
+    the gallery of `model_name` (INSIGHTFACE_MODEL_NAME by default).
+    '''
+    suffix = gallery_suffix(model_name)
+    if Config.FACE_REPOSITORY_BACKEND == 'local':
+        from db.local_store import LocalFaceRepository
+        return LocalFaceRepository(os.path.join(Config.LOCAL_STORE_PATH, suffix) if suffix else None)
+    if Config.FACE_REPOSITORY_BACKEND == 'mongo':
+        return FaceRepository(f'{Config.COLLECTION_NAME}_{suffix}' if suffix else None)
+    raise ValueError(f'Unknown face repository backend: {Config.FACE_REPOSITORY_BACKEND}')
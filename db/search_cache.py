@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from config import Config
+from metrics import metrics
+
+class SearchCache:
+    '''
+    Bounded LRU/TTL cache of search results for near-duplicate embeddings.
+    Entries are bucketed by a random-hyperplane locality-sensitive hash of
+    the normalized embedding; a lookup hits when a cached vector in the same
+    bucket is within `tolerance` cosine distance of the query. Every
+    invalidation bumps `generation`, so results of searches that started
+    before it are not cached.
+    '''
+
+    def __init__(
+        self,
+        capacity: int = Config.SEARCH_CACHE_SIZE,
+        ttl: float = Config.SEARCH_CACHE_TTL,
+        tolerance: float = Config.SEARCH_CACHE_TOLERANCE,
+        num_bits: int = Config.SEARCH_CACHE_HASH_BITS,
+        dim: int = 512,
+        seed: int = 0
+    ):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.tolerance = tolerance
+        self._planes = np.random.default_rng(seed).standard_normal((num_bits, dim)).astype(np.float32)
+        self._powers = 1 << np.arange(num_bits, dtype=np.int64)
+        self._lock = threading.Lock()
+        # entry id -> (bucket, vector, result, created_at), in LRU order
+        self._entries: OrderedDict[int, tuple] = OrderedDict()
+        self._buckets: dict[int, set[int]] = {}
+        self._next_id = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(emb: np.ndarray) -> np.ndarray:
+        vector = np.asarray(emb, dtype=np.float32).reshape(-1)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _bucket(self, vector: np.ndarray) -> int:
+        return int(((self._planes @ vector) > 0) @ self._powers)
+
+    def _remove(self, entry_id: int) -> None:
+        bucket = self._entries.pop(entry_id)[0]
+        ids = self._buckets[bucket]
+        ids.discard(entry_id)
+        if not ids:
+            del self._buckets[bucket]
+
+    def get(self, emb: np.ndarray) -> tuple[str, float, bool] | None:
+        vector = self._normalize(emb)
+        bucket = self._bucket(vector)
+        now = time.monotonic()
+
+        with self._lock:
+            for entry_id in list(self._buckets.get(bucket, ())):
+                _, cached_vector, result, created_at = self._entries[entry_id]
+                if now - created_at > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                if 1 - float(cached_vector @ vector) <= self.tolerance:
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    metrics.inc('search_cache_hits')
+                    return result
+            self.misses += 1
+        metrics.inc('search_cache_misses')
+        return None
+
+    def put(self, emb: np.ndarray, result: tuple[str, float, bool], generation: int) -> None:
+        '''
+        Caches the result of a search that started at `generation`. It is
+        dropped if an invalidation happened since, as the search may have
+        missed the change.
+        '''
+        vector = self._normalize(emb)
+        bucket = self._bucket(vector)
+        with self._lock:
+            if generation != self.generation:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (bucket, vector, result, time.monotonic())
+            self._buckets.setdefault(bucket, set()).add(entry_id)
+            while len(self._entries) > self.capacity:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_insert(self, emb: np.ndarray) -> None:
+        '''Drops entries for which the newly inserted embedding would be a better match.'''
+        vector = self._normalize(emb)
+        with self._lock:
+            self.generation += 1
+            stale = [
+                entry_id for entry_id, (_, cached_vector, result, _) in self._entries.items()
+                if (1 + float(cached_vector @ vector)) / 2 > result[1]
+            ]
+            for entry_id in stale:
+                self._remove(entry_id)
+
+    def invalidate_name(self, name: str) -> None:
+        '''Drops entries whose result refers to a renamed or deleted name.'''
+        with self._lock:
+            self.generation += 1
+            stale = [
+                entry_id for entry_id, (_, _, result, _) in self._entries.items()
+                if result[0] == name
+            ]
+            for entry_id in stale:
+                self._remove(entry_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._buckets.clear()
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hit_ratio,
+        }
@@ -0,0 +1,46 @@
+import numpy as np
+from bson.binary import Binary
+from config import Config
+
+# BSON binary vector (subtype 9) layout: dtype byte, padding byte, then the
+# little-endian vector data
+VECTOR_SUBTYPE = 9
+DTYPE_INT8 = 0x03
+DTYPE_FLOAT32 = 0x27
+
+def encode_vector(emb: np.ndarray, storage_format: str | None = None):
+    '''
+    Encodes an embedding for storage or querying.
+    'float32' and 'int8' produce packed BSON binary vectors, 'list' keeps the
+    legacy array of doubles.
+    '''
+    storage_format = storage_format or Config.VECTOR_STORAGE_FORMAT
+    vector = np.asarray(emb, dtype=np.float32).reshape(-1)
+
+    if storage_format == 'float32':
+        return Binary(bytes([DTYPE_FLOAT32, 0]) + vector.astype('<f4').tobytes(), VECTOR_SUBTYPE)
+    if storage_format == 'int8':
+        # Cosine similarity ignores scale, so each vector is scaled to use
+        # the full int8 range
+        scale = 127 / max(float(np.abs(vector).max()), 1e-12)
+        quantized = np.clip(np.rint(vector * scale), -127, 127).astype(np.int8)
+        return Binary(bytes([DTYPE_INT8, 0]) + quantized.tobytes(), VECTOR_SUBTYPE)
+    if storage_format == 'list':
+        return vector.tolist()
+    raise ValueError(f'Unknown vector storage format: {storage_format}')
+
+def decode_vector(value) -> np.ndarray:
+    '''Decodes a stored vector into a float32 array without intermediate lists.'''
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        dtype = value[0]
+        if dtype == DTYPE_FLOAT32:
+            return np.frombuffer(value, dtype='<f4', offset=2).astype(np.float32, copy=False)
+        if dtype == DTYPE_INT8:
+            return np.frombuffer(value, dtype=np.int8, offset=2).astype(np.float32)
+        raise ValueError(f'Unsupported binary vector dtype: {dtype:#04x}')
+    return np.asarray(value, dtype=np.float32)
+
+def storage_format_of(value) -> str:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {DTYPE_FLOAT32: 'float32', DTYPE_INT8: 'int8'}.get(value[0], 'unknown')
+    return 'list'
@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+import numpy as np
+from config import Config
+
+class RollingHistogram:
+    '''Keeps the last `window` observations and reports percentiles over them.'''
+
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentiles(self, quantiles=(50, 95, 99)) -> dict[int, float]:
+        if not self.samples:
+            return {q: 0.0 for q in quantiles}
+        values = np.percentile(np.fromiter(self.samples, dtype=np.float64), quantiles)
+        return dict(zip(quantiles, values.tolist()))
+
+class Metrics:
+    '''
+    Process-wide latency histograms, value histograms and counters.
+    Stage latencies are recorded with `timer`/`timed` and exported in the
+    Prometheus text format by `render_prometheus`.
+    '''
+
+    def __init__(self, window: int = Config.METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._latencies: dict[str, RollingHistogram] = {}
+        self._values: dict[str, RollingHistogram] = {}
+        self._counters: dict[tuple[str, str], float] = {}
+        self._gauges: dict[str, float] = {}
+        # Metrics is imported first by the app, so this approximates process start
+        self.started_at = time.perf_counter()
+
+    def observe_latency(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if stage not in self._latencies:
+                self._latencies[stage] = RollingHistogram(self._window)
+            self._latencies[stage].observe(seconds)
+
+    def observe_value(self, name: str, value: float) -> None:
+        with self._lock:
+            if name not in self._values:
+                self._values[name] = RollingHistogram(self._window)
+            self._values[name].observe(value)
+
+    def inc(self, name: str, label: str = '', value: float = 1) -> None:
+        with self._lock:
+            key = (name, label)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def uptime(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def reset(self) -> None:
+        with self._lock:
+            self._latencies.clear()
+            self._values.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('errors', stage)
+            raise
+        finally:
+            self.observe_latency(stage, time.perf_counter() - start)
+
+    def timed(self, stage: str):
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'latencies': {
+                    stage: {'count': h.count, 'sum': h.total, **h.percentiles()}
+                    for stage, h in self._latencies.items()
+                },
+                'values': {
+                    name: {'count': h.count, 'sum': h.total, **h.percentiles()}
+                    for name, h in self._values.items()
+                },
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+            }
+
+    def render_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+
+        def summary(metric: str, stats: dict, labels: str = '') -> None:
+            sep = ',' if labels else ''
+            for q in (50, 95, 99):
+                lines.append(f'{metric}{{{labels}{sep}quantile="{q / 100}"}} {stats[q]:.6f}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{metric}_sum{suffix} {stats["sum"]:.6f}')
+            lines.append(f'{metric}_count{suffix} {stats["count"]}')
+
+        lines.append('# TYPE face_recognition_stage_seconds summary')
+        for stage, stats in sorted(snapshot['latencies'].items()):
+            summary('face_recognition_stage_seconds', stats, f'stage="{stage}"')
+
+        for name, stats in sorted(snapshot['values'].items()):
+            metric = f'face_recognition_{name}'
+            lines.append(f'# TYPE {metric} summary')
+            summary(metric, stats)
+
+        counter_names = sorted({name for name, _ in snapshot['counters']})
+        for name in counter_names:
+            metric = f'face_recognition_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for (counter, label), value in sorted(snapshot['counters'].items()):
+                if counter == name:
+                    labels = f'{{stage="{label}"}}' if label else ''
+                    lines.append(f'{metric}{labels} {value:g}')
+
+        for name, value in sorted(snapshot['gauges'].items()):
+            metric = f'face_recognition_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value:g}')
+
+        return '\n'.join(lines) + '\n'
+
+    def render_markdown(self) -> str:
+        snapshot = self.snapshot()
+        if not snapshot['latencies']:
+            return 'No frames processed yet.'
+
+        lines = [
+            '| Stage | Calls | p50 (ms) | p95 (ms) | p99 (ms) | Errors |',
+            '|---|---|---|---|---|---|',
+        ]
+        for stage, stats in sorted(snapshot['latencies'].items()):
+            errors = snapshot['counters'].get(('errors', stage), 0)
+            lines.append(
+                f'| {stage} | {stats["count"]} | {stats[50] * 1000:.1f} '
+                f'| {stats[95] * 1000:.1f} | {stats[99] * 1000:.1f} | {errors:g} |'
+            )
+
+        faces = snapshot['values'].get('faces_per_frame')
+        if faces:
+            lines.append('')
+            lines.append(f'Faces per frame: p50 {faces[50]:.0f}, p95 {faces[95]:.0f}, p99 {faces[99]:.0f}')
+
+        rejections = {
+            label: value for (name, label), value in snapshot['counters'].items()
+            if name == 'quality_rejections'
+        }
+        if rejections:
+            lines.append('')
+            lines.append('Low-quality faces skipped: ' + ', '.join(
+                f'{reason} {count:g}' for reason, count in sorted(rejections.items())
+            ))
+        return '\n'.join(lines)
+
+# Shared instance used by the analyzer, repository and service
+metrics = Metrics()
@@ -0,0 +1,80 @@
+import numpy as np
+from insightface.app.common import Face
+from services.face_analyzer import FaceAnalyzer
+from services.face_tracker import bbox_iou
+from config import Config
+
+class AdaptiveDetector:
+    '''
+    Per-stream detection schedule. Most frames are detected at a low
+    resolution, with extra full-detail passes over crops around the faces
+    seen in the previous frame so that small and distant faces are kept.
+    A full `DETECTION_SIZE` pass over the whole frame runs periodically to
+    pick up new faces the low-resolution pass misses.
+    '''
+
+    def __init__(self):
+        self.frame_index = 0
+        self.regions: list[np.ndarray] = []
+
+    def detect(
+        self,
+        face_analyzer: FaceAnalyzer,
+        frame: np.ndarray,
+        input_size: tuple[int, int] | None = None
+    ) -> list[Face]:
+        # `input_size` overrides `DETECTION_SIZE` for the full passes
+        if frame is None:
+            return []
+
+        full_pass = (
+            not Config.ADAPTIVE_DETECTION
+            or self.frame_index % Config.ADAPTIVE_DETECTION_FULL_INTERVAL == 0
+        )
+        self.frame_index += 1
+
+        if full_pass:
+            faces = face_analyzer.detect_faces(frame, input_size=input_size)
+        else:
+            faces = face_analyzer.detect_faces(frame, input_size=Config.ADAPTIVE_DETECTION_LOW_SIZE)
+            for region in self.regions:
+                faces = self._merge(faces, self._detect_region(face_analyzer, frame, region))
+
+        self.regions = [face.bbox for face in faces]
+        return faces
+
+    def _detect_region(self, face_analyzer: FaceAnalyzer, frame: np.ndarray, bbox: np.ndarray) -> list[Face]:
+        height, width = frame.shape[:2]
+        margin_x = (bbox[2] - bbox[0]) * Config.ADAPTIVE_DETECTION_ROI_MARGIN
+        margin_y = (bbox[3] - bbox[1]) * Config.ADAPTIVE_DETECTION_ROI_MARGIN
+        x0, y0 = max(0, int(bbox[0] - margin_x)), max(0, int(bbox[1] - margin_y))
+        x1, y1 = min(width, int(bbox[2] + margin_x)), min(height, int(bbox[3] + margin_y))
+        if x1 <= x0 or y1 <= y0:
+            return []
+
+        faces = face_analyzer.detect_faces(
+            np.ascontiguousarray(frame[y0:y1, x0:x1]),
+            input_size=Config.ADAPTIVE_DETECTION_ROI_SIZE
+        )
+        offset = np.array([x0, y0], dtype=np.float32)
+        for face in faces:
+            face.bbox = face.bbox + np.tile(offset, 2)
+            if face.kps is not None:
+                face.kps = face.kps + offset
+        return faces
+
+    @staticmethod
+    def _merge(faces: list[Face], candidates: list[Face]) -> list[Face]:
+        # Keeps the higher scoring detection when a region pass finds a face
+        # already found by the low-resolution pass
+        merged = list(faces)
+        for candidate in candidates:
+            overlap = next(
+                (i for i, face in enumerate(merged) if bbox_iou(face.bbox, candidate.bbox) > 0.4),
+                None
+            )
+            if overlap is None:
+                merged.append(candidate)
+            elif candidate.det_score > merged[overlap].det_score:
+                merged[overlap] = candidate
+        return merged
@@ -1,24 +1,253 @@
-from insightface.app import FaceAnalysis
+import glob
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import onnx
+import onnxruntime
+from insightface.app.common import Face
+from insightface.model_zoo import ArcFaceONNX, RetinaFace
+from insightface.utils import face_align
+from insightface.utils.storage import ensure_available
 import numpy as np
 from config import Config
+from metrics import metrics
+from services.inference_scheduler import InferenceScheduler
+from services.session_pool import SessionPool
 
 class FaceAnalyzer:
-    def __init__(self):
-        print('Initializing FaceAnalysis model...')
-        self.app = FaceAnalysis(
-            name=Config.INSIGHTFACE_MODEL_NAME,
-            providers=Config.INSIGHTFACE_PROVIDERS,
-            allowed_modules=['detection', 'recognition']
+    # Serializes recognition model quantization between concurrent loads
+    _quantize_lock = threading.Lock()
+
+    def __init__(self, model_name: str | None = None):
+        # `model_name` is an InsightFace model pack, optionally suffixed with
+        # ':int8' to run a dynamically quantized recognition model
+        self.model_name = model_name or Config.INSIGHTFACE_MODEL_NAME
+        self.pack, _, variant = self.model_name.partition(':')
+        self.quantize_recognition = variant == 'int8'
+        print(f'Initializing FaceAnalysis model ({self.model_name})...')
+        start = time.perf_counter()
+        model_dir = ensure_available('models', self.pack, root='~/.insightface')
+        onnx_files = sorted(glob.glob(os.path.join(model_dir, '*.onnx')))
+        pool_size = max(1, Config.INFERENCE_SESSION_POOL_SIZE)
+
+        # Models are classified from their graphs without creating sessions,
+        # so the pack's landmark and attribute models are never loaded
+        tasks = {onnx_file: self._model_task(onnx_file) for onnx_file in onnx_files}
+
+        # Sessions are created concurrently; ONNX Runtime releases the GIL
+        # while loading and optimizing the graphs. Only the first copy of
+        # each model writes the optimized graph cache.
+        loads = [
+            (onnx_file, task, slot == 0)
+            for slot in range(pool_size)
+            for onnx_file, task in tasks.items() if task is not None
+        ]
+        with ThreadPoolExecutor(max_workers=len(loads) or 1) as executor:
+            models = list(executor.map(lambda args: self._load_model(*args), loads))
+
+        det_models = [m for m in models if m.taskname == 'detection']
+        rec_models = [m for m in models if m.taskname == 'recognition']
+        if not det_models or not rec_models:
+            raise RuntimeError(f'Model pack "{self.pack}" needs a detection and a recognition model.')
+
+        # Each request checks a session out, so concurrent streams run in parallel
+        self.detectors = SessionPool(det_models, 'detection')
+        self.recognizers = SessionPool(rec_models, 'recognition')
+        self.det_model, self.rec_model = det_models[0], rec_models[0]
+
+        if Config.INSIGHTFACE_WARMUP:
+            self.warmup()
+
+        # Shares the recognition sessions between concurrent sessions in batches
+        self.scheduler = InferenceScheduler(self.recognizers) if Config.INFERENCE_BATCHING else None
+        print(
+            f'FaceAnalysis model initialization complete with {pool_size} session(s) per model '
+            f'({time.perf_counter() - start:.2f}s).'
         )
-        self.app.prepare(ctx_id=Config.INSIGHTFACE_CTX_ID)
-        print('FaceAnalysis model initialization complete.')
 
-    def compute_embeddings(self, image: np.ndarray):
+    def _session_options(self) -> onnxruntime.SessionOptions:
+        options = onnxruntime.SessionOptions()
+        # Pooled sessions split the cores between them unless set explicitly
+        pool_size = max(1, Config.INFERENCE_SESSION_POOL_SIZE)
+        options.intra_op_num_threads = Config.ONNX_INTRA_OP_THREADS or (
+            max(1, (os.cpu_count() or 1) // pool_size) if pool_size > 1 else 0
+        )
+        options.inter_op_num_threads = Config.ONNX_INTER_OP_THREADS
+        options.graph_optimization_level = getattr(
+            onnxruntime.GraphOptimizationLevel, Config.ONNX_GRAPH_OPTIMIZATION_LEVEL
+        )
+        return options
+
+    def _cached_graph(self, onnx_file: str) -> str | None:
+        '''Path of the model's optimized graph cache, None when caching is disabled.'''
+        if not Config.ONNX_OPTIMIZED_MODEL_DIR:
+            return None
+        name = os.path.splitext(os.path.basename(onnx_file))[0]
+        # Optimized graphs are specific to the execution providers they were optimized for
+        providers = '-'.join(
+            (p if isinstance(p, str) else p[0]).removesuffix('ExecutionProvider')
+            for p in Config.INSIGHTFACE_PROVIDERS
+        )
+        return os.path.join(
+            os.path.expanduser(Config.ONNX_OPTIMIZED_MODEL_DIR),
+            f'{self.pack}_{name}_{Config.ONNX_GRAPH_OPTIMIZATION_LEVEL}_{providers}.onnx'
+        )
+
+    def _create_session(self, onnx_file: str, write_cache: bool) -> onnxruntime.InferenceSession:
+        # Cache the optimized graph so later starts skip graph optimization
+        cached_file = self._cached_graph(onnx_file)
+        if cached_file and os.path.exists(cached_file):
+            options = self._session_options()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+            try:
+                return onnxruntime.InferenceSession(
+                    cached_file, sess_options=options, providers=Config.INSIGHTFACE_PROVIDERS
+                )
+            except Exception as e:
+                # A corrupt cache is rebuilt from the original model below
+                print(f'Could not load optimized graph {cached_file}, using the original model: {e}')
+
+        options = self._session_options()
+        tmp_file = None
+        if cached_file and write_cache:
+            # ONNX Runtime writes the optimized graph in place, so it goes to a
+            # file private to this load and is published once complete. Other
+            # processes and concurrent loads never open a partial graph.
+            os.makedirs(os.path.dirname(cached_file), exist_ok=True)
+            tmp_file = f'{cached_file}.{os.getpid()}-{threading.get_ident()}.tmp.onnx'
+            options.optimized_model_filepath = tmp_file
+        try:
+            session = onnxruntime.InferenceSession(
+                onnx_file, sess_options=options, providers=Config.INSIGHTFACE_PROVIDERS
+            )
+            if tmp_file and os.path.exists(tmp_file):
+                os.replace(tmp_file, cached_file)
+            return session
+        finally:
+            if tmp_file and os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    @staticmethod
+    def _model_task(onnx_file: str) -> str | None:
+        '''
+        Mirrors insightface's ModelRouter, keeping only detection and
+        recognition models, but reads the graph's inputs and outputs with
+        `onnx` instead of creating a session.
+        '''
+        graph = onnx.load(onnx_file, load_external_data=False).graph
+        initializers = {init.name for init in graph.initializer}
+        inputs = [i for i in graph.input if i.name not in initializers]
+        input_shape = [
+            d.dim_value if d.HasField('dim_value') else d.dim_param
+            for d in inputs[0].type.tensor_type.shape.dim
+        ]
+
+        if len(graph.output) >= 5:
+            return 'detection'
+        if input_shape[2] in (96, 192) or len(inputs) == 2:
+            return None # landmark, attribute and swapper models are not used
+        if isinstance(input_shape[2], int) and input_shape[2] == input_shape[3] and input_shape[2] >= 112 and input_shape[2] % 16 == 0:
+            return 'recognition'
+        return None
+
+    def _load_model(self, onnx_file: str, task: str, write_cache: bool = True):
+        # The models are configured directly rather than with prepare(), whose
+        # set_providers() call would rebuild the session from scratch
+        if task == 'detection':
+            det_model = RetinaFace(model_file=onnx_file, session=self._create_session(onnx_file, write_cache))
+            det_model.det_thresh = Config.DETECTION_THRESHOLD
+            # Like prepare(), a detector with a fixed input size keeps it
+            if det_model.input_size is None:
+                det_model.input_size = Config.DETECTION_SIZE
+            return det_model
+
+        session_file = self._quantized_model(onnx_file) if self.quantize_recognition else onnx_file
+        # The original file is kept as model_file, since ArcFaceONNX reads
+        # its input normalization from the unquantized graph
+        return ArcFaceONNX(model_file=onnx_file, session=self._create_session(session_file, write_cache))
+
+    @classmethod
+    def _quantized_model(cls, onnx_file: str) -> str:
+        '''Returns an INT8 copy of the model, quantizing it on first use.'''
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        cache_dir = os.path.expanduser(Config.ONNX_OPTIMIZED_MODEL_DIR or os.path.dirname(onnx_file))
+        name = os.path.splitext(os.path.basename(onnx_file))[0]
+        quantized_file = os.path.join(cache_dir, f'{name}_int8.onnx')
+        with cls._quantize_lock:
+            if not os.path.exists(quantized_file):
+                print(f'Quantizing {name} to INT8...')
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_file = f'{quantized_file}.tmp'
+                quantize_dynamic(onnx_file, tmp_file, weight_type=QuantType.QInt8)
+                os.replace(tmp_file, quantized_file)
+        return quantized_file
+
+    def warmup(self) -> None:
+        # The first inference pays for memory arena allocation; run it on
+        # dummy inputs so the first real frame does not
+        start = time.perf_counter()
+        width, height = Config.DETECTION_SIZE
+        for det_model in self.detectors:
+            det_model.detect(np.zeros((height, width, 3), dtype=np.uint8), max_num=0, metric='default')
+        size = self.rec_model.input_size[0]
+        for rec_model in self.recognizers:
+            rec_model.get_feat([np.zeros((size, size, 3), dtype=np.uint8)])
+        print(f'Model warmup complete ({time.perf_counter() - start:.2f}s).')
+
+    @metrics.timed('detection')
+    def detect_faces(self, image: np.ndarray, input_size: tuple[int, int] | None = None) -> list[Face]:
+        # `input_size` overrides the prepared `DETECTION_SIZE` for this call
         if image is None:
             return []
         try:
-            faces = self.app.get(image)
+            with self.detectors.checkout() as det_model:
+                bboxes, kpss = det_model.detect(
+                    image, input_size=input_size, max_num=0, metric='default'
+                )
+        except Exception as e:
+            print(f'Error detecting faces: {e}')
+            metrics.inc('errors', 'detection')
+            return []
+
+        return [
+            Face(
+                bbox=bboxes[i, 0:4],
+                kps=kpss[i] if kpss is not None else None,
+                det_score=bboxes[i, 4]
+            )
+            for i in range(bboxes.shape[0])
+        ]
+
+    @metrics.timed('embedding')
+    def embed_faces(self, image: np.ndarray, faces: list[Face]) -> list[Face]:
+        # Runs the recognition model only on the given detections,
+        # setting `face.embedding` in place
+        if not faces:
+            return faces
+        try:
+            if self.scheduler is not None:
+                self.scheduler.embed(image, faces)
+                return faces
+
+            crops = [
+                face_align.norm_crop(image, landmark=face.kps, image_size=self.rec_model.input_size[0])
+                for face in faces
+            ]
+            with self.recognizers.checkout() as rec_model:
+                embeddings = rec_model.get_feat(crops)
+            for face, embedding in zip(faces, embeddings):
+                face.embedding = embedding
             return faces
         except Exception as e:
             print(f'Error computing embeddings: {e}')
-            return []
\ No newline at end of file
+            metrics.inc('errors', 'embedding')
+            return []
+
+    @metrics.timed('compute_embeddings')
+    def compute_embeddings(self, image: np.ndarray):
+        faces = self.detect_faces(image)
+        if not faces:
+            return []
+        return self.embed_faces(image, faces)
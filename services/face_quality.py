@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+from insightface.app.common import Face
+from config import Config
+from metrics import metrics
+
+def face_sharpness(image: np.ndarray, face: Face) -> float:
+    '''
+    Variance of the Laplacian over the face crop, resized so scores compare
+    across face sizes. The crop is inset by QUALITY_BLUR_INSET on every side,
+    so edges along the box (background, or a drawn annotation) do not count
+    as sharpness.
+    '''
+    height, width = image.shape[:2]
+    x0, y0, x1, y1 = face.bbox
+    inset_x, inset_y = (x1 - x0) * Config.QUALITY_BLUR_INSET, (y1 - y0) * Config.QUALITY_BLUR_INSET
+    x0, y0, x1, y1 = int(x0 + inset_x), int(y0 + inset_y), int(x1 - inset_x), int(y1 - inset_y)
+    x0, y0, x1, y1 = max(0, x0), max(0, y0), min(width, x1), min(height, y1)
+    if x1 <= x0 or y1 <= y0:
+        return 0.0
+    crop = cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_RGB2GRAY)
+    crop = cv2.resize(crop, (Config.QUALITY_BLUR_CROP_SIZE, Config.QUALITY_BLUR_CROP_SIZE))
+    return float(cv2.Laplacian(crop, cv2.CV_64F).var())
+
+def face_pose(face: Face) -> tuple[float, float]:
+    '''
+    Rough (yaw, pitch) from the five landmarks. Yaw is the asymmetry of the
+    nose between the eyes, from 0 (frontal) to 1 (nose at an eye's line or
+    beyond); pitch is the nose height between the eyes and the mouth,
+    around 0.5 for a level face.
+    '''
+    left_eye, right_eye, nose, left_mouth, right_mouth = face.kps
+    to_left, to_right = nose[0] - left_eye[0], right_eye[0] - nose[0]
+    if to_left <= 0 or to_right <= 0:
+        yaw = 1.0
+    else:
+        yaw = float(abs(to_left - to_right) / (to_left + to_right))
+
+    eye_y = (left_eye[1] + right_eye[1]) / 2
+    mouth_y = (left_mouth[1] + right_mouth[1]) / 2
+    pitch = float((nose[1] - eye_y) / (mouth_y - eye_y)) if mouth_y > eye_y else 0.0
+    return yaw, pitch
+
+def assess_face(image: np.ndarray, face: Face) -> str | None:
+    '''Returns why the face is unusable for recognition, or None if it passes.'''
+    x0, y0, x1, y1 = face.bbox
+    if min(x1 - x0, y1 - y0) < Config.QUALITY_MIN_FACE_SIZE:
+        return 'size'
+    if face.det_score < Config.QUALITY_MIN_DET_SCORE:
+        return 'score'
+    if face.kps is not None:
+        yaw, pitch = face_pose(face)
+        min_pitch, max_pitch = Config.QUALITY_PITCH_RANGE
+        if yaw > Config.QUALITY_MAX_YAW or not min_pitch <= pitch <= max_pitch:
+            return 'pose'
+    # The Laplacian is the most expensive check, so it runs last
+    if face_sharpness(image, face) < Config.QUALITY_MIN_SHARPNESS:
+        return 'blur'
+    return None
+
+def filter_faces(image: np.ndarray, faces: list[Face]) -> tuple[list[Face], list[Face]]:
+    '''
+    Splits detections into (accepted, rejected) by `assess_face`, counting
+    rejections per reason. Every face is accepted when QUALITY_FILTER is off.
+    '''
+    if not Config.QUALITY_FILTER or not faces:
+        return faces, []
+
+    accepted, rejected = [], []
+    for face in faces:
+        reason = assess_face(image, face)
+        if reason is None:
+            accepted.append(face)
+        else:
+            metrics.inc('quality_rejections', reason)
+            rejected.append(face)
+    return accepted, rejected
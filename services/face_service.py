@@ -1,26 +1,246 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import cv2
-from db.repositories import FaceRepository
+from insightface.app.common import Face
+from db.base_repository import BaseFaceRepository
+from db.repositories import create_face_repository
 from services.face_analyzer import FaceAnalyzer
+from services.face_tracker import FaceTracker
+from services.adaptive_detector import AdaptiveDetector
+from services.face_quality import assess_face, filter_faces
+from services.renderer import Annotation, renderer
+from services.load_governor import LoadGovernor
 from config import Config
+from metrics import metrics
+
+QUALITY_MESSAGES = {
+    'size': 'The face is too small, move closer to the camera.',
+    'score': 'The face is not clearly visible.',
+    'pose': 'Please face the camera directly.',
+    'blur': 'The snapshot is too blurry.',
+}
+
+class FrameAnalysis:
+    '''Output of the inference stage for one frame, consumed by `FaceService.resolve_frame`.'''
+
+    def __init__(self, frame: np.ndarray):
+        self.frame = frame
+        self.started = time.perf_counter()
+        self.model = None # Model chosen by the load governor, None without one
+        self.tracked = [] # (track, face) for every detection, with a tracker
+        self.to_search = [] # (track or None, face) still to be searched
+        self.rejected = [] # Faces failing the quality gate, neither embedded nor searched
 
 class FaceService:
-    def __init__(self):
-        self.face_analyzer = FaceAnalyzer()
-        self.face_repository = FaceRepository()
+    def __init__(
+        self,
+        face_analyzer: FaceAnalyzer | None = None,
+        face_repository: BaseFaceRepository | None = None
+    ):
+        self.governor = LoadGovernor() if Config.GOVERNOR_ENABLED else None
+        primary_model = face_analyzer.model_name if face_analyzer else Config.INSIGHTFACE_MODEL_NAME
+        extra_models = [m for m in self.governor.models() if m != primary_model] if self.governor else []
 
-    def process_frame_for_prediction(self, frame: np.ndarray):
-        image_out = frame.copy()
-        faces = self.face_analyzer.compute_embeddings(frame)
+        # Model loading and the database connection are independent,
+        # so they are initialized concurrently
+        with ThreadPoolExecutor(max_workers=2 + 2 * len(extra_models)) as executor:
+            analyzer_future = executor.submit(FaceAnalyzer) if face_analyzer is None else None
+            repository_future = executor.submit(create_face_repository) if face_repository is None else None
+            extra_futures = {
+                model: (executor.submit(FaceAnalyzer, model), executor.submit(create_face_repository, model))
+                for model in extra_models
+            }
+            self.face_analyzer = analyzer_future.result() if analyzer_future else face_analyzer
+            self.face_repository = repository_future.result() if repository_future else face_repository
 
-        if not faces:
+            # One analyzer and gallery per model the governor can switch to
+            self.analyzers = {primary_model: self.face_analyzer}
+            self.galleries = {primary_model: self.face_repository}
+            for model, (model_analyzer, gallery) in extra_futures.items():
+                self.analyzers[model] = model_analyzer.result()
+                self.galleries[model] = gallery.result()
+
+        if self.governor is not None:
+            self.governor.restrict(self._covered_models(primary_model))
+
+        # Repository calls from the streaming pipeline run here, so database
+        # latency overlaps with model inference on the stream threads
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=Config.REPOSITORY_IO_THREADS, thread_name_prefix='repository-io'
+        )
+        self.renderer = renderer
+        self._members_lock = threading.Lock()
+        self._member_added_at: dict[str, float] = {}
+        self._first_frame_reported = False
+
+    @metrics.timed('analysis')
+    def analyze_frame(
+        self,
+        frame: np.ndarray,
+        tracker: FaceTracker | None = None,
+        detector: AdaptiveDetector | None = None
+    ) -> FrameAnalysis:
+        '''
+        Inference half of `identify_faces`: detection, tracking and embedding.
+        With a tracker, faces on confirmed tracks reuse their cached identity
+        and only new, drifted or stale tracks are embedded; those still
+        unidentified are marked pending until `resolve_frame` confirms them.
+        With a detector, detection follows the stream's adaptive schedule.
+        '''
+        analysis = FrameAnalysis(frame)
+        # Under load, the governor picks a lighter model and detection size
+        input_size = None
+        if self.governor is not None:
+            level = self.governor.current
+            analysis.model, input_size = level['model'], level['detection_size']
+        analyzer = self.analyzers.get(analysis.model, self.face_analyzer)
+
+        if detector is not None:
+            faces = detector.detect(analyzer, frame, input_size)
+        else:
+            faces = analyzer.detect_faces(frame, input_size=input_size)
+
+        if tracker is None:
+            faces, analysis.rejected = filter_faces(frame, faces)
+            analysis.to_search = [(None, face) for face in analyzer.embed_faces(frame, faces)]
+            return analysis
+
+        with tracker.lock:
+            # Identities confirmed with another model would be re-identified
+            # and drift-checked against incomparable embeddings
+            if tracker.model != analysis.model:
+                tracker.reset(analysis.model)
+            analysis.tracked = tracker.update(faces)
+            stale = [(track, face) for track, face in analysis.tracked if tracker.needs_recognition(track)]
+            # Low-quality faces are not recognized; a verified track keeps its identity
+            _, rejected = filter_faces(frame, [face for _, face in stale])
+            rejected_ids = {id(face) for face in rejected}
+            analysis.rejected = [
+                face for track, face in stale
+                if id(face) in rejected_ids and not track.is_verified
+            ]
+            stale = [(track, face) for track, face in stale if id(face) not in rejected_ids]
+            for track, _ in stale:
+                track.pending = True
+
+        if stale:
+            analyzer.embed_faces(frame, [face for _, face in stale])
+            with tracker.lock:
+                for track, face in stale:
+                    if face.embedding is not None and not tracker.reidentify(track, face.embedding):
+                        analysis.to_search.append((track, face))
+                    else:
+                        track.pending = False
+        return analysis
+
+    @metrics.timed('resolution')
+    def resolve_frame(self, analysis: FrameAnalysis, tracker: FaceTracker | None = None):
+        '''
+        Repository half of `identify_faces`: searches the embedded faces and
+        returns (face, (name, similarity, match)) for every identified face.
+        It does no model inference, so it can overlap the next frame's
+        `analyze_frame`.
+        '''
+        # Embeddings are searched in the gallery of the model that produced them
+        gallery = self.galleries.get(analysis.model, self.face_repository)
+        try:
+            results = gallery.search_faces([face.embedding for _, face in analysis.to_search])
+        except Exception:
+            # Failed searches are retried on the track's next frame
+            if tracker is not None:
+                with tracker.lock:
+                    for track, _ in analysis.to_search:
+                        track.pending = False
+            raise
+        finally:
+            if self.governor is not None:
+                self.governor.record_frame(time.perf_counter() - analysis.started)
+
+        if Config.IDENTITY_AUTO_ENROLL:
+            self._collect_members(gallery, [face.embedding for _, face in analysis.to_search], results)
+
+        if tracker is None:
+            return [(face, result) for (_, face), result in zip(analysis.to_search, results)]
+
+        # `confirm` also clears `pending`, in the same lock acquisition, so the
+        # next frame never sees a searched track as unconfirmed and not pending
+        with tracker.lock:
+            for (track, face), result in zip(analysis.to_search, results):
+                tracker.confirm(track, face.embedding, result)
+            return [
+                (face, (track.name, track.similarity, track.match))
+                for track, face in analysis.tracked
+                if track.is_verified
+            ]
+
+    def identify_faces(
+        self,
+        frame: np.ndarray,
+        tracker: FaceTracker | None = None,
+        detector: AdaptiveDetector | None = None
+    ):
+        '''Returns (face, (name, similarity, match)) for every face in the frame.'''
+        return self.resolve_frame(self.analyze_frame(frame, tracker, detector), tracker)
+
+    @metrics.timed('frame')
+    def process_frame_for_prediction(
+        self,
+        frame: np.ndarray,
+        tracker: FaceTracker | None = None,
+        detector: AdaptiveDetector | None = None,
+        in_place: bool = False
+    ):
+        with metrics.timer('identification'):
+            analysis = self.analyze_frame(frame, tracker, detector)
+            identified = self.resolve_frame(analysis, tracker)
+        return self.render_prediction(frame, identified, analysis.rejected, in_place)
+
+    def finish_prediction(self, analysis: FrameAnalysis, tracker: FaceTracker | None = None, in_place: bool = False):
+        '''
+        Resolves and renders a frame analyzed by `analyze_frame`, recording
+        the same 'identification' and 'frame' latencies as
+        `process_frame_for_prediction`, measured from the start of the analysis.
+        '''
+        identified = self.resolve_frame(analysis, tracker)
+        metrics.observe_latency('identification', time.perf_counter() - analysis.started)
+        image_out = self.render_prediction(analysis.frame, identified, analysis.rejected, in_place)
+        metrics.observe_latency('frame', time.perf_counter() - analysis.started)
+        return image_out
+
+    def predict_overlay(
+        self,
+        frame: np.ndarray,
+        tracker: FaceTracker | None = None,
+        detector: AdaptiveDetector | None = None
+    ) -> list[dict]:
+        '''Like `process_frame_for_prediction`, but returns box and label data instead of a frame.'''
+        analysis = self.analyze_frame(frame, tracker, detector)
+        identified = self.resolve_frame(analysis, tracker)
+        self._report_identified(identified)
+        return self.renderer.overlay(self.prediction_annotations(identified, analysis.rejected))
+
+    def render_prediction(self, frame: np.ndarray, identified, rejected=(), in_place: bool = False) -> np.ndarray:
+        # `in_place` draws on the caller's frame instead of a copy
+        self._report_identified(identified)
+        image_out = frame if in_place else frame.copy()
+        if not identified and not rejected:
             return image_out
 
-        for face in faces:
-            name, similarity, match = self.face_repository.search_face(face.embedding)
-            bbox = face.bbox.astype(int)
-            coord = (bbox[0], bbox[1])
+        return self.draw_predictions(image_out, identified, rejected)
+
+    def _report_identified(self, identified) -> None:
+        metrics.observe_value('faces_per_frame', len(identified))
 
+        if identified and not self._first_frame_reported:
+            self._first_frame_reported = True
+            metrics.set_gauge('time_to_first_recognized_frame_seconds', metrics.uptime())
+            print(f'Time to first recognized frame: {metrics.uptime():.2f}s')
+
+    @staticmethod
+    def prediction_annotations(identified, rejected=()) -> list[Annotation]:
+        annotations = []
+        for face, (name, similarity, match) in identified:
             if match:
                 label = f'{name} ({similarity:.2f})'
                 color = (92, 184, 92)
@@ -31,53 +251,58 @@ class FaceService:
                 else:
                      label = 'Unknown'
                      color = (250, 17, 61) # Red for unknown
+            annotations.append(Annotation(face.bbox, color, label))
 
-            cv2.rectangle(image_out, (bbox[0], bbox[1]), (bbox[2], bbox[3]), color, 2)
-            
-            font_scale = 1.5
-            font_thickness = 2
-            (w, h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)
-            cv2.rectangle(image_out, (coord[0], coord[1] - h - 5), (coord[0] + w, coord[1]), color, -1)
-            cv2.putText(
-                image_out, label, (coord[0], coord[1] - 4),
-                cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), font_thickness
-            )
-        return image_out
+        # Rejected faces were not searched and get the low quality label
+        for face in rejected:
+            annotations.append(Annotation(face.bbox, (150, 150, 150), 'Low quality'))
+        return annotations
+
+    @metrics.timed('annotation')
+    def draw_predictions(self, image_out: np.ndarray, identified, rejected=()) -> np.ndarray:
+        # Draws on `image_out` itself
+        return self.renderer.draw(image_out, self.prediction_annotations(identified, rejected), in_place=True)
 
-    def process_frame_for_registration_preview(self, frame: np.ndarray):
+    def process_frame_for_registration_preview(self, frame: np.ndarray, in_place: bool = False):
         if frame is None:
             return frame
 
-        image_out = frame.copy()
-        faces = self.face_analyzer.compute_embeddings(frame)
-
-        if faces:
-            face = faces[0] # use the first detected face
-            bbox = face.bbox.astype(int)
-            coord = (bbox[0], bbox[1])
-            
-            label = 'Face to Register'
-            color = (72, 114, 211)
-
-            cv2.rectangle(image_out, (bbox[0], bbox[1]), (bbox[2], bbox[3]), color, 3)
-
-            font_scale = 1.5
-            font_thickness = 2
-            (w, h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, font_thickness)
-            cv2.rectangle(image_out, (coord[0], coord[1] - h - 5), (coord[0] + w, coord[1]), color, -1)
-            cv2.putText(
-                image_out, label, (coord[0], coord[1] - 4),
-                cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), font_thickness
-            )
+        # The preview only draws boxes, so the recognition model is skipped
+        faces = self.face_analyzer.detect_faces(frame)
+        if not faces:
+            return frame if in_place else frame.copy()
 
-            if len(faces) > 1:
-                for face in faces[1:]:
-                    bbox = face.bbox.astype(int)
-                    coord = (bbox[0], bbox[1])
-                    label = 'Ignored'
-                    color = (250, 17, 61)
-                    cv2.rectangle(image_out, (bbox[0], bbox[1]), (bbox[2], bbox[3]), color, 3)
-        return image_out
+        with metrics.timer('annotation'):
+            # Only the first detected face is registered
+            annotations = [Annotation(faces[0].bbox, (72, 114, 211), 'Face to Register', thickness=3)]
+            annotations += [Annotation(face.bbox, (250, 17, 61), thickness=3) for face in faces[1:]]
+            return self.renderer.draw(frame, annotations, in_place)
+
+    def _embed_snapshot(self, frame_snapshot: np.ndarray) -> tuple[Face | None, str | None]:
+        '''Detects, checks and embeds the first face of a snapshot, returning (face, error).'''
+        faces = self.face_analyzer.detect_faces(frame_snapshot)
+
+        if not faces:
+            return None, 'Error: No face detected in the snapshot.'
+
+        if Config.QUALITY_FILTER:
+            reason = assess_face(frame_snapshot, faces[0])
+            if reason is not None:
+                return None, f'Error: {QUALITY_MESSAGES[reason]} Please try again.'
+
+        # Only the face being registered is embedded, extra faces are ignored
+        faces = self.face_analyzer.embed_faces(frame_snapshot, faces[:1])
+
+        if not faces or faces[0].embedding is None:
+            return None, 'Error: Could not compute an embedding for the detected face.'
+        return faces[0], None
+
+    def _secondary_embeddings(self, frame_snapshot: np.ndarray, face: Face):
+        '''Yields (gallery, embedding) for the galleries of the governor's other models.'''
+        for model, gallery in self._secondary_galleries():
+            model_face = Face(bbox=face.bbox, kps=face.kps, det_score=face.det_score)
+            if self.analyzers[model].embed_faces(frame_snapshot, [model_face]) and model_face.embedding is not None:
+                yield gallery, model_face.embedding
 
     def register_new_face(self, name: str, frame_snapshot: np.ndarray) -> tuple[str, bool]:
         if frame_snapshot is None:
@@ -91,13 +316,12 @@ class FaceService:
         if self.face_repository.is_name_taken(name):
             return f'Error: Name "{name}" is already registered.', False
 
-        faces = self.face_analyzer.compute_embeddings(frame_snapshot)
+        face, error = self._embed_snapshot(frame_snapshot)
+        if error:
+            return error, False
 
-        if not faces:
-            return 'Error: No face detected in the snapshot.', False
-
-        embedding_to_register = faces[0].embedding
-        existing_name, similarity, match = self.face_repository.search_face(embedding_to_register)
+        embedding_to_register = face.embedding
+        existing_name, similarity, match = self.face_repository.search_faces([embedding_to_register])[0]
 
         if existing_name is not None and match:
             return (
@@ -107,9 +331,57 @@ class FaceService:
             )
 
         self.face_repository.insert_embedding(name, embedding_to_register)
+        for gallery, embedding in self._secondary_embeddings(frame_snapshot, face):
+            gallery.insert_embedding(name, embedding)
         print(f'Registered "{name}". Total embeddings: {self.face_repository.get_count()}')
         return f'Success: User "{name}" registered!', True
 
+    def add_face_sample(self, name: str, frame_snapshot: np.ndarray) -> tuple[str, bool]:
+        '''Adds another snapshot (e.g. different light or pose) to a registered identity.'''
+        if frame_snapshot is None:
+            return 'Error: No image captured. Please ensure camera is active.', False
+
+        if not name or not name.strip():
+            return 'Error: Name cannot be empty.', False
+
+        name = name.strip()
+
+        if not self.face_repository.is_name_taken(name):
+            return f'Error: "{name}" is not registered yet. Register the face first.', False
+
+        face, error = self._embed_snapshot(frame_snapshot)
+        if error:
+            return error, False
+
+        existing_name, similarity, match = self.face_repository.search_faces([face.embedding])[0]
+
+        if match and existing_name != name:
+            return (
+                f'Error: This face seems to be "{existing_name}" '
+                f'(Similarity: {similarity:.2f}). Sample not added.',
+                False
+            )
+
+        if not self.face_repository.add_member(name, face.embedding):
+            return f'Info: This sample is too similar to the ones stored for "{name}". No changes made.', False
+
+        for gallery, embedding in self._secondary_embeddings(frame_snapshot, face):
+            gallery.add_member(name, embedding)
+        return f'Success: Added a sample to "{name}".', True
+
+    def _collect_members(self, gallery: BaseFaceRepository, embeddings, results) -> None:
+        # Confident matches become template members, at most one per
+        # identity every IDENTITY_AUTO_ENROLL_INTERVAL seconds
+        now = time.monotonic()
+        for embedding, (name, similarity, match) in zip(embeddings, results):
+            if not match or similarity < Config.IDENTITY_AUTO_ENROLL_SIMILARITY:
+                continue
+            with self._members_lock:
+                if now - self._member_added_at.get(name, float('-inf')) < Config.IDENTITY_AUTO_ENROLL_INTERVAL:
+                    continue
+                self._member_added_at[name] = now
+            self.io_executor.submit(gallery.add_member, name, embedding)
+
     def rename_existing_face(self, old_name: str, new_name: str, password: str) -> tuple[str, bool]:
         if not old_name:
             return 'Error: Please select a name to rename.', False
@@ -128,6 +400,8 @@ class FaceService:
         success = self.face_repository.update_name(old_name, new_name)
 
         if success:
+            for _, gallery in self._secondary_galleries():
+                gallery.update_name(old_name, new_name)
             return f'Success: Renamed "{old_name}" to "{new_name}".', True
         else:
             return f'Error: Failed to rename "{old_name}" to "{new_name}".', False
@@ -143,10 +417,36 @@ class FaceService:
         success = self.face_repository.delete_name(name_to_delete)
 
         if success:
+            for _, gallery in self._secondary_galleries():
+                gallery.delete_name(name_to_delete)
             return f'Success: Deleted "{name_to_delete}".', True
         else:
             return f'Error: Failed to delete "{name_to_delete}".', False
 
+    def _covered_models(self, primary_model: str) -> set[str]:
+        '''
+        Models whose gallery holds every registered identity. Stepping down
+        to any other model would leave the missing identities unknown.
+        '''
+        primary_count = self.face_repository.get_count()
+        covered = {primary_model}
+        for model, gallery in self._secondary_galleries():
+            count = gallery.get_count()
+            if count >= primary_count:
+                covered.add(model)
+            else:
+                print(
+                    f'Load governor: the {model} gallery has {count} of {primary_count} identities, '
+                    f'so its levels are disabled until it is backfilled.'
+                )
+        return covered
+
+    def _secondary_galleries(self) -> list[tuple[str, BaseFaceRepository]]:
+        return [
+            (model, gallery) for model, gallery in self.galleries.items()
+            if gallery is not self.face_repository
+        ]
+
     def get_all_registered_names(self) -> list[str]:
         return self.face_repository.get_all_names()
 
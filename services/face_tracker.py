@@ -0,0 +1,149 @@
+import threading
+import numpy as np
+from insightface.app.common import Face
+from config import Config
+
+def bbox_iou(a: np.ndarray, b: np.ndarray) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(np.dot(a.flatten(), b.flatten()) / denom) if denom > 0 else 0.0
+
+class Track:
+    def __init__(self, track_id: int, bbox: np.ndarray):
+        self.track_id = track_id
+        self.bbox = bbox
+        self.verified_bbox = bbox
+        self.embedding = None
+        self.name = ''
+        self.similarity = 0.0
+        self.match = False
+        self.frames_since_verified = 0
+        self.missed = 0
+        self.pending = False # A repository search for this track is in flight
+
+    @property
+    def is_verified(self) -> bool:
+        return self.embedding is not None
+
+class FaceTracker:
+    '''
+    Associates detections across frames by bounding-box IoU so that the
+    recognition model and the repository lookup only run for new tracks,
+    tracks that drifted, or tracks left unconfirmed for too many frames.
+    One tracker is kept per streaming session. Callers hold `lock` around
+    updates, since identities may be confirmed from another thread while
+    the next frame is being tracked.
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tracks: list[Track] = []
+        self.lost: list[Track] = []
+        self._next_id = 1
+        self.model = None # Model that produced the tracks' embeddings
+
+    def reset(self, model: str | None = None) -> None:
+        '''
+        Drops every track. Embeddings from different models are not
+        comparable, so the tracker is reset when the model changes.
+        '''
+        self.tracks = []
+        self.lost = []
+        self.model = model
+
+    def update(self, faces: list[Face]) -> list[tuple[Track, Face]]:
+        '''
+        Matches the frame's detections to existing tracks (greedy by IoU) and
+        starts a new track for every unmatched detection. Returns one
+        (track, face) pair per detection, in detection order.
+        '''
+        pairs = sorted(
+            (
+                (bbox_iou(track.bbox, face.bbox), t, f)
+                for t, track in enumerate(self.tracks)
+                for f, face in enumerate(faces)
+            ),
+            reverse=True
+        )
+
+        assigned: dict[int, Track] = {}
+        used_tracks = set()
+        for iou, t, f in pairs:
+            if iou < Config.TRACK_IOU_THRESHOLD:
+                break
+            if t in used_tracks or f in assigned:
+                continue
+            used_tracks.add(t)
+            assigned[f] = self.tracks[t]
+
+        # Unmatched tracks are retired to the lost pool, where they remain
+        # available for re-identification for a few frames
+        for track in self.lost:
+            track.missed += 1
+        for t, track in enumerate(self.tracks):
+            if t not in used_tracks and track.is_verified:
+                track.missed = 1
+                self.lost.append(track)
+
+        self.tracks = [track for t, track in enumerate(self.tracks) if t in used_tracks]
+        self.lost = [track for track in self.lost if track.missed <= Config.TRACK_MAX_MISSED]
+
+        result = []
+        for f, face in enumerate(faces):
+            track = assigned.get(f)
+            if track is None:
+                track = Track(self._next_id, face.bbox)
+                self._next_id += 1
+                self.tracks.append(track)
+            else:
+                track.bbox = face.bbox
+                track.frames_since_verified += 1
+            result.append((track, face))
+        return result
+
+    def needs_recognition(self, track: Track) -> bool:
+        if track.pending:
+            return False
+        return (
+            not track.is_verified
+            or track.frames_since_verified >= Config.TRACK_REVERIFY_FRAMES
+            or bbox_iou(track.bbox, track.verified_bbox) < Config.TRACK_DRIFT_IOU
+        )
+
+    def reidentify(self, track: Track, embedding: np.ndarray) -> bool:
+        '''
+        Recovers the identity of a track that was lost for a few frames
+        (e.g. brief occlusion) by comparing embeddings, avoiding a new search.
+        '''
+        if track.is_verified:
+            return False
+
+        best, best_sim = None, Config.TRACK_REID_SIMILARITY
+        for lost in self.lost:
+            sim = cosine_similarity(lost.embedding, embedding)
+            if sim >= best_sim:
+                best, best_sim = lost, sim
+
+        if best is None:
+            return False
+
+        self.lost.remove(best)
+        self.confirm(track, embedding, (best.name, best.similarity, best.match))
+        return True
+
+    def confirm(self, track: Track, embedding: np.ndarray, result: tuple[str, float, bool]) -> None:
+        track.embedding = embedding
+        track.name, track.similarity, track.match = result
+        track.verified_bbox = track.bbox
+        track.frames_since_verified = 0
+        track.pending = False
+
+    def __deepcopy__(self, memo):
+        # Held in the gr.State dict; every session starts with an empty tracker
+        return FaceTracker()
@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from insightface.app.common import Face
+from insightface.utils import face_align
+from config import Config
+from metrics import metrics
+from services.session_pool import SessionPool
+
+class InferenceScheduler:
+    '''
+    Micro-batches recognition inference across concurrent callers.
+    Aligned face crops from every frame submitted within a short window are
+    run through the recognition model as one batch, and the embeddings are
+    routed back to their callers. One batching thread runs per pooled
+    recognition session, so batches also run in parallel.
+    '''
+
+    def __init__(
+        self,
+        recognizers: SessionPool,
+        max_batch: int = Config.INFERENCE_BATCH_SIZE,
+        max_wait: float = Config.INFERENCE_BATCH_WAIT
+    ):
+        self.recognizers = recognizers
+        self.input_size = recognizers.models[0].input_size[0]
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: queue.Queue = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._run, name=f'inference-scheduler-{i}', daemon=True)
+            for i in range(len(recognizers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def embed(self, image: np.ndarray, faces: list[Face]) -> None:
+        '''Blocks until the faces' embeddings are computed, setting `face.embedding`.'''
+        if not faces:
+            return
+        # Alignment runs on the caller's thread; only the model call is batched
+        crops = [
+            face_align.norm_crop(image, landmark=face.kps, image_size=self.input_size)
+            for face in faces
+        ]
+        future = Future()
+        self._queue.put((crops, future))
+        for face, embedding in zip(faces, future.result()):
+            face.embedding = embedding
+
+    def _collect(self) -> list[tuple[list[np.ndarray], Future]]:
+        requests = [self._queue.get()]
+        size = len(requests[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _run(self) -> None:
+        while True:
+            requests = self._collect()
+            crops = [crop for request_crops, _ in requests for crop in request_crops]
+
+            try:
+                with metrics.timer('embedding_batch'), self.recognizers.checkout() as rec_model:
+                    embeddings = np.concatenate([
+                        rec_model.get_feat(crops[start:start + self.max_batch])
+                        for start in range(0, len(crops), self.max_batch)
+                    ])
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            metrics.observe_value('inference_batch_size', len(crops))
+            metrics.observe_value('inference_batch_requests', len(requests))
+            metrics.observe_value('inference_batch_occupancy', min(1.0, len(crops) / self.max_batch))
+
+            start = 0
+            for request_crops, future in requests:
+                future.set_result(embeddings[start:start + len(request_crops)])
+                start += len(request_crops)
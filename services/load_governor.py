@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque
+import numpy as np
+from config import Config
+from metrics import metrics
+
+class LoadGovernor:
+    '''
+    Trades recognition quality for throughput under load. It watches the
+    end-to-end latency of processed frames and how many streamed frames
+    are dropped because processing fell behind. When either is too high it
+    steps down to the next of `GOVERNOR_LEVELS` (smaller detection size,
+    longer frame interval, lighter model), and steps back up once there is
+    headroom again. Shared by every session, since they share the CPU.
+    '''
+
+    def __init__(self, levels: list[dict] = Config.GOVERNOR_LEVELS):
+        if not levels:
+            raise ValueError('The load governor needs at least one level.')
+        self.levels = levels
+        self.level = 0
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=Config.GOVERNOR_WINDOW)
+        self._frames = 0
+        self._drops = 0
+        self._changed_at = time.monotonic()
+        metrics.set_gauge('governor_level', self.level)
+
+    @property
+    def current(self) -> dict:
+        return self.levels[self.level]
+
+    def models(self) -> list[str]:
+        '''Models used by any level, in level order.'''
+        return list(dict.fromkeys(level['model'] for level in self.levels))
+
+    def restrict(self, models: set[str]) -> None:
+        '''Drops the levels whose model is not in `models`.'''
+        with self._lock:
+            levels = [level for level in self.levels if level['model'] in models]
+            if not levels:
+                raise ValueError('None of the load governor levels uses an available model.')
+            self.levels = levels
+            self.level = 0
+        metrics.set_gauge('governor_level', self.level)
+
+    def frame_interval(self) -> float:
+        '''
+        Minimum time between processed frames. Frames already arrive every
+        STREAM_INTERVAL, so levels that do not exceed it do not throttle, and
+        half an interval of tolerance keeps early (jittered) frames from
+        being skipped at the others.
+        '''
+        interval = self.current['stream_interval']
+        if interval <= Config.STREAM_INTERVAL:
+            return 0.0
+        return interval - Config.STREAM_INTERVAL / 2
+
+    def record_frame(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self._frames += 1
+            self._evaluate()
+
+    def record_drop(self) -> None:
+        with self._lock:
+            self._drops += 1
+
+    def _evaluate(self) -> None:
+        if len(self._latencies) < Config.GOVERNOR_MIN_SAMPLES:
+            return
+        if time.monotonic() - self._changed_at < Config.GOVERNOR_COOLDOWN:
+            return
+
+        latency = float(np.percentile(self._latencies, 95))
+        drop_ratio = self._drops / (self._frames + self._drops)
+        overloaded = latency > Config.GOVERNOR_TARGET_LATENCY or drop_ratio > Config.GOVERNOR_MAX_DROP_RATIO
+        idle = (
+            latency < Config.GOVERNOR_TARGET_LATENCY * Config.GOVERNOR_HEADROOM
+            and drop_ratio < Config.GOVERNOR_MAX_DROP_RATIO * Config.GOVERNOR_HEADROOM
+        )
+
+        if overloaded and self.level < len(self.levels) - 1:
+            self._set_level(self.level + 1, latency, drop_ratio)
+        elif idle and self.level > 0:
+            self._set_level(self.level - 1, latency, drop_ratio)
+
+    def _set_level(self, level: int, latency: float, drop_ratio: float) -> None:
+        direction = 'down' if level > self.level else 'up'
+        self.level = level
+        # Measurements from the previous level do not describe the new one
+        self._latencies.clear()
+        self._frames = self._drops = 0
+        self._changed_at = time.monotonic()
+
+        metrics.set_gauge('governor_level', level)
+        metrics.inc('governor_transitions', direction)
+        print(
+            f'Load governor stepped {direction} to level {level} {self.current} '
+            f'(p95 frame latency {latency * 1000:.0f}ms, {drop_ratio:.0%} frames dropped).'
+        )
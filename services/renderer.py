@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from config import Config
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+TEXT_COLOR = (255, 255, 255)
+LABEL_PADDING = 4
+
+class Annotation:
+    '''A box to draw, with an optional label above its top-left corner.'''
+
+    def __init__(self, bbox, color: tuple[int, int, int], label: str | None = None, thickness: int = 2):
+        self.bbox = [int(v) for v in bbox[:4]]
+        self.color = color
+        self.label = label
+        self.thickness = thickness
+
+    def to_dict(self) -> dict:
+        return {'bbox': self.bbox, 'label': self.label, 'color': list(self.color)}
+
+class AnnotationRenderer:
+    '''
+    Draws annotation boxes and labels. Each label is rasterized once into a
+    sprite (the text on its filled background) and kept in an LRU cache
+    keyed by (text, color), so later frames copy pixels instead of calling
+    `getTextSize` and `putText` again.
+    '''
+
+    def __init__(
+        self,
+        capacity: int = Config.RENDER_LABEL_CACHE_SIZE,
+        font_scale: float = 1.5,
+        font_thickness: int = 2
+    ):
+        self.capacity = capacity
+        self.font_scale = font_scale
+        self.font_thickness = font_thickness
+        self._lock = threading.Lock()
+        self._sprites: OrderedDict[tuple, np.ndarray] = OrderedDict()
+
+    def sprite(self, text: str, color: tuple[int, int, int]) -> np.ndarray:
+        key = (text, color)
+        with self._lock:
+            sprite = self._sprites.get(key)
+            if sprite is not None:
+                self._sprites.move_to_end(key)
+                return sprite
+
+        (w, h), baseline = cv2.getTextSize(text, FONT, self.font_scale, self.font_thickness)
+        # The box leaves LABEL_PADDING pixels above the text and room below
+        # its baseline for descenders (g, j, p, y)
+        sprite = np.empty((h + baseline + LABEL_PADDING, w, 3), dtype=np.uint8)
+        sprite[:] = color
+        cv2.putText(sprite, text, (0, h + LABEL_PADDING), FONT, self.font_scale, TEXT_COLOR, self.font_thickness)
+
+        with self._lock:
+            self._sprites[key] = sprite
+            while len(self._sprites) > self.capacity:
+                self._sprites.popitem(last=False)
+        return sprite
+
+    @staticmethod
+    def _blit(image: np.ndarray, sprite: np.ndarray, x: int, y: int) -> None:
+        # (x, y) is the sprite's top-left corner; parts outside the image are clipped
+        height, width = image.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + sprite.shape[1], width), min(y + sprite.shape[0], height)
+        if x1 > x0 and y1 > y0:
+            image[y0:y1, x0:x1] = sprite[y0 - y:y1 - y, x0 - x:x1 - x]
+
+    def draw(self, image: np.ndarray, annotations: list[Annotation], in_place: bool = False) -> np.ndarray:
+        '''Draws on `image` itself when `in_place`, otherwise on a copy.'''
+        image_out = image if in_place else image.copy()
+        for annotation in annotations:
+            x0, y0, x1, y1 = annotation.bbox
+            cv2.rectangle(image_out, (x0, y0), (x1, y1), annotation.color, annotation.thickness)
+            if annotation.label:
+                sprite = self.sprite(annotation.label, annotation.color)
+                self._blit(image_out, sprite, x0, y0 - sprite.shape[0])
+        return image_out
+
+    @staticmethod
+    def overlay(annotations: list[Annotation]) -> list[dict]:
+        '''Box and label data for clients that draw the overlay themselves.'''
+        return [annotation.to_dict() for annotation in annotations]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sprites.clear()
+
+# Shared by every session, so label sprites are reused across streams
+renderer = AnnotationRenderer()
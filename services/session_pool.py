@@ -0,0 +1,42 @@
+import queue
+import time
+from contextlib import contextmanager
+from metrics import metrics
+
+class SessionPool:
+    '''
+    Fixed set of interchangeable model instances, each backed by its own
+    ONNX Runtime session. A caller checks one out for the duration of an
+    inference, so concurrent requests run on separate sessions instead of
+    contending for the thread pool of a single one.
+    '''
+
+    def __init__(self, models: list, name: str):
+        if not models:
+            raise ValueError(f'Session pool "{name}" needs at least one model.')
+        self.models = list(models)
+        self.name = name
+        self._idle: queue.Queue = queue.Queue()
+        for model in self.models:
+            self._idle.put(model)
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def __iter__(self):
+        return iter(self.models)
+
+    @contextmanager
+    def checkout(self):
+        start = time.perf_counter()
+        model = self._idle.get()
+        metrics.observe_latency(f'{self.name}_session_wait', time.perf_counter() - start)
+        metrics.set_gauge(f'{self.name}_sessions_in_use', self.in_use())
+        try:
+            yield model
+        finally:
+            self._idle.put(model)
+            metrics.set_gauge(f'{self.name}_sessions_in_use', self.in_use())
+
+    def in_use(self) -> int:
+        return len(self.models) - self._idle.qsize()
@@ -0,0 +1,144 @@
+import threading
+import time
+from concurrent.futures import Executor, Future, wait
+from typing import Any, Callable
+import numpy as np
+
+class StreamWorker:
+    '''
+    Runs frame processing on a background thread with a single-slot mailbox.
+    A new frame overwrites any frame still waiting to be processed, and
+    `submit` returns immediately with the most recent processed result, so
+    latency stays bounded when processing is slower than the stream.
+
+    With a `finish_fn`, processing is a two-stage pipeline: `process_fn`
+    runs on the worker thread and its output is finished on `executor`,
+    so the next frame's first stage overlaps the previous frame's second
+    (e.g. model inference overlapping repository I/O).
+
+    `min_interval` returns the minimum time between accepted frames; frames
+    arriving sooner are skipped, lowering the effective stream rate.
+    `on_drop` is called whenever a waiting frame is overwritten.
+    '''
+
+    def __init__(
+        self,
+        process_fn: Callable[[np.ndarray], Any],
+        name: str = 'stream-worker',
+        finish_fn: Callable[[Any], np.ndarray] | None = None,
+        executor: Executor | None = None,
+        min_interval: Callable[[], float] | None = None,
+        on_drop: Callable[[], None] | None = None
+    ):
+        if finish_fn is not None and executor is None:
+            raise ValueError('A finish_fn needs an executor to run on.')
+        self._process_fn = process_fn
+        self._finish_fn = finish_fn
+        self._executor = executor
+        self._min_interval = min_interval
+        self._on_drop = on_drop
+        self._accepted_at = 0.0
+        self._cond = threading.Condition()
+        self._pending = None
+        self._latest = None
+        self._latest_seq = 0
+        self._stopped = False
+
+        self.frames_received = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.frames_throttled = 0
+        self.errors = 0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame: np.ndarray) -> np.ndarray:
+        if frame is None:
+            return frame
+
+        now = time.monotonic()
+        dropped = False
+        with self._cond:
+            self.frames_received += 1
+            if self._min_interval is not None and now - self._accepted_at < self._min_interval():
+                self.frames_throttled += 1
+            else:
+                self._accepted_at = now
+                if self._pending is not None:
+                    self.frames_dropped += 1
+                    dropped = True
+                self._pending = frame
+                self._cond.notify()
+            latest = self._latest
+
+        if dropped and self._on_drop is not None:
+            self._on_drop()
+
+        # Until the first frame is processed, echo the raw frame
+        return latest if latest is not None else frame
+
+    def _run(self) -> None:
+        seq = 0
+        in_flight: Future | None = None
+        while True:
+            with self._cond:
+                while self._pending is None and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                frame, self._pending = self._pending, None
+            seq += 1
+
+            try:
+                result = self._process_fn(frame)
+            except Exception as e:
+                self._record_error(e)
+                continue
+
+            if self._finish_fn is None:
+                self._publish(seq, result)
+                continue
+
+            # At most one frame is in the second stage; waiting only after
+            # this frame's first stage is what lets the two overlap
+            if in_flight is not None:
+                wait([in_flight])
+            in_flight = self._executor.submit(self._finish_fn, result)
+            in_flight.add_done_callback(lambda future, seq=seq: self._on_finished(seq, future))
+
+    def _on_finished(self, seq: int, future: Future) -> None:
+        try:
+            self._publish(seq, future.result())
+        except Exception as e:
+            self._record_error(e)
+
+    def _publish(self, seq: int, result: np.ndarray) -> None:
+        with self._cond:
+            self.frames_processed += 1
+            if seq > self._latest_seq:
+                self._latest, self._latest_seq = result, seq
+
+    def _record_error(self, error: Exception) -> None:
+        print(f'Error processing streamed frame: {error}')
+        with self._cond:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'received': self.frames_received,
+                'processed': self.frames_processed,
+                'dropped': self.frames_dropped,
+                'throttled': self.frames_throttled,
+                'errors': self.errors,
+            }
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def __deepcopy__(self, memo):
+        # Owns a thread, so it is shared rather than copied
+        return self